@@ -75,13 +75,11 @@ def run_rag_evaluation(rag, test_cases):
     
     print(f"\nRunning RAG on {len(test_cases)} test cases...\n")
     
-    for i, test in enumerate(test_cases, 1):
-        print(f"[{i}/{len(test_cases)}] Processing: {test['question'][:50]}...")
-        
-        # Run your RAG system
-        answer = rag.llm_generate(test['question'], source_language='en')
-        contexts = rag.context  # Retrieved chunks
-        
+    # Run your RAG system on all questions in one batched call
+    questions = [test['question'] for test in test_cases]
+    answers = rag.llm_generate_batch(questions, source_language='en')
+    
+    for test, answer, contexts in zip(test_cases, answers, rag.contexts):  # contexts: retrieved chunks
         # Store results
         data['question'].append(test['question'])
         data['contexts'].append(contexts)
@@ -184,8 +182,6 @@ def save_results(results, filename='evaluation_results.json'):
     print(f"\n💾 Results saved to {filename}")
 
 
-================================
-
 if __name__ == "__main__":
     # Load your RAG system
     print("Loading RAG system...")
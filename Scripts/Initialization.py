@@ -1,35 +1,58 @@
 from sentence_transformers import SentenceTransformer
-import faiss 
+import faiss
 import sqlite3
 import numpy as np
+import os
 from rag_functions import embed_add, vectorize_query_retrieve
 from Rag_model import RAG
-from chunking import create_all_chunks, load_chunks
+from chunking import iter_scraped_chunks
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
-from chunking import create_all_chunks, save_chunks
 
 
-def process_and_store_chunks(path = 'Json_files'):
-  all_chunks = create_all_chunks(path)
-  save_chunks(all_chunks)
-  print(f"Created {len(all_chunks)} chunks")
-
+def process_and_store_chunks(path = 'Json_files', faiss_path='medical_rag.index', sqlite_path='medical_chunks.db'):
   dimension = 768
   embedding_model = 'moka-ai/m3e-base'
   llm_model = "Qwen/Qwen2-1.5B-Instruct"
 
-  rag = RAG(dimension=dimension, embedding_model=embedding_model, model_name=llm_model)
-
-  print("Loading and chunking documents...")
-  all_chunks = load_chunks('chunks.pkl')
+  # Reuse the saved index and only re-embed what changed since the last run
+  if os.path.exists(faiss_path) and os.path.exists(sqlite_path):
+    rag = RAG.load_from_saved(faiss_path, sqlite_path, embedding_model=embedding_model, model_name=llm_model)
+  else:
+    rag = RAG(dimension=dimension, embedding_model=embedding_model, model_name=llm_model)
+
+  print(f"Syncing documents from {path}...")
+  stats = rag.sync_documents(path)
+
+  if stats['chunks_added'] or stats['chunks_removed'] or not os.path.exists(faiss_path):
+    rag.save_databases(faiss_path, sqlite_path)
+  else:
+    rag.commit()
+    print("✓ Corpus unchanged, index not rewritten")
+  rag.close()
+
+
+def process_and_store_common_diseases(path='common_diseases', faiss_path='common_diseases.index',
+                                      sqlite_path='common_diseases.db', workers=4):
+  # The scraped corpus is English, so it gets its own English embedding model and index;
+  # English questions against it skip the EN→ZH→EN translation round trip
+  dimension = 384
+  embedding_model = 'all-MiniLM-L6-v2'
+  llm_model = "Qwen/Qwen2-1.5B-Instruct"
 
-  print(f"\nAdding {len(all_chunks)} chunks to database...")
-  for chunk in all_chunks:
-      rag.add_chunk(chunk)
+  rag = RAG(dimension=dimension, embedding_model=embedding_model, model_name=llm_model,
+            sqlite_path=sqlite_path, corpus_language='en')
+  # Full rebuild: the new index is empty, so drop rows (and their full-text entries) left by a previous build
+  with rag.conn:
+    rag.conn.execute("DELETE FROM chunks")
+    rag.conn.execute("DELETE FROM chunks_fts")
 
-  rag.commit()
-  rag.save_databases()
+  print(f"Loading scraped documents from {path} with {workers} workers...")
+  rag.add_chunks(iter_scraped_chunks(path, workers=workers))
+  rag.save_databases(faiss_path, sqlite_path)
+  rag.close()
 
 
-process_and_store_chunks()
+if __name__ == "__main__":
+  process_and_store_chunks()
+  process_and_store_common_diseases()
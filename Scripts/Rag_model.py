@@ -1,154 +1,1311 @@
-from sentence_transformers import SentenceTransformer
 import faiss
 import sqlite3
 import numpy as np
-from rag_functions import embed_add, vectorize_query_retrieve
-from transformers import AutoTokenizer, AutoModelForCausalLM, MarianMTModel, MarianTokenizer
+from rag_functions import (embed_add, embed_add_batch, vectorize_queries_retrieve_batch,
+                           load_chunk_store, lookup_chunks, split_complete_sentences, content_hash,
+                           chunk_row, select_chunk_ids, SQLITE_MAX_PARAMS, METADATA_COLUMNS)
+from caching import EmbeddingCache, SemanticCache
+from embedding_backends import EMBEDDING_BACKENDS, load_embedding_model, check_agreement
+from torch_settings import QUANTIZATIONS, resolve_dtype, quantize_int8, set_threads
+from context_packing import pack_context, chunk_sentences
+import lexical
+from translation import TranslationCache, translate_batch, translate_texts
+from index_factory import (create_index, train_index, set_search_params, get_search_params,
+                           auto_tune, save_index_config, load_index_config, ensure_id_map,
+                           has_id_map, remove_ids, index_size_bytes, copy_search_params)
+from transformers import (AutoTokenizer, AutoModelForCausalLM, MarianMTModel, MarianTokenizer, TextIteratorStreamer,
+                          DynamicCache)
 import torch
+import asyncio
+import copy
 import json
+import threading
+from pathlib import Path
+import time
+from itertools import islice
+
+
+MODES = ('full', 'retrieval')
+
+# 'vector': FAISS only, 'lexical': FTS5 BM25 only, 'hybrid': both fused by reciprocal rank
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+
+# Language of the indexed texts: the original Chinese corpus or the scraped English one
+CORPUS_LANGUAGES = ('zh', 'en')
+
+# Map flat vector storage straight from the file (falls back to the generic mmap flag on older FAISS)
+FAISS_MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+TRANSLATION_MODELS = {
+    'en-zh': "Helsinki-NLP/opus-mt-en-zh",
+    'zh-en': "Helsinki-NLP/opus-mt-zh-en",
+}
+
 
 class RAG:
-    def __init__(self, dimension, embedding_model='all-MiniLM-L6-v2', model_name="Qwen/Qwen2-1.5B-Instruct", enable_translation=True):
+    def __init__(self, dimension, embedding_model='all-MiniLM-L6-v2', model_name="Qwen/Qwen2-1.5B-Instruct", enable_translation=True,
+                 index_factory='Flat', nprobe=None, efSearch=None, preload_chunks=False,
+                 query_cache_size=1024, query_cache_path=None,
+                 answer_cache_size=0, answer_cache_threshold=0.95, answer_cache_ttl=3600,
+                 translation_cache_path='translation_cache.db', mode='full', lazy_load=True,
+                 use_prefix_cache=True, context_token_budget=768, context_max_distance=None,
+                 context_dedup_threshold=0.9, sqlite_path='medical_chunks.db', corpus_language='zh',
+                 search_mode='vector', lexical_fast_path=True, hybrid_candidates=20, rerank_factor=None,
+                 embedding_backend='torch', embedding_min_cosine=0.99,
+                 llm_dtype='auto', llm_quantization=None, torch_threads=None,
+                 translation_num_beams=None, translation_length_ratio=2.0, translation_max_input_tokens=512,
+                 translation_quantization=None):
 
-        self.system_prompt = "You are a medical assistant. Give answers to the questions using your knowledge in combination with retrieved information"
+        self._configure(dimension=dimension, embedding_model=embedding_model, model_name=model_name,
+                        enable_translation=enable_translation, mode=mode,
+                        query_cache_size=query_cache_size, query_cache_path=query_cache_path,
+                        answer_cache_size=answer_cache_size, answer_cache_threshold=answer_cache_threshold,
+                        answer_cache_ttl=answer_cache_ttl,
+                        translation_cache_path=translation_cache_path, use_prefix_cache=use_prefix_cache,
+                        context_token_budget=context_token_budget, context_max_distance=context_max_distance,
+                        context_dedup_threshold=context_dedup_threshold,
+                        corpus_language=corpus_language, search_mode=search_mode,
+                        lexical_fast_path=lexical_fast_path, hybrid_candidates=hybrid_candidates,
+                        rerank_factor=rerank_factor,
+                        embedding_backend=embedding_backend, embedding_min_cosine=embedding_min_cosine,
+                        llm_dtype=llm_dtype, llm_quantization=llm_quantization, torch_threads=torch_threads,
+                        translation_num_beams=translation_num_beams,
+                        translation_length_ratio=translation_length_ratio,
+                        translation_max_input_tokens=translation_max_input_tokens,
+                        translation_quantization=translation_quantization)
 
-        # LLM setup
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        
-        # Embedding setup
-        self.dimension = dimension
-        self.embedding_model = SentenceTransformer(embedding_model)
-        self.faiss_index = faiss.IndexFlatL2(dimension)
+        # Index setup
+        start = time.perf_counter()
+        self.index_factory = index_factory
+        self.faiss_index = create_index(dimension, index_factory)
+        set_search_params(self.faiss_index, nprobe=nprobe, efSearch=efSearch)
+        self.load_times['faiss_index'] = time.perf_counter() - start
 
         # Database setup
-        self.conn = sqlite3.connect('medical_chunks.db')
+        start = time.perf_counter()
+        self.conn = sqlite3.connect(sqlite_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
-        
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chunks (
-                id INTEGER PRIMARY KEY,
-                text TEXT NOT NULL,
-                document TEXT NOT NULL,
-                section TEXT NOT NULL)
-            ''')
+        self._create_tables()
+
+        # Optional in-memory id -> chunk map so retrieval never touches SQLite
+        self.chunk_store = load_chunk_store(self.cursor) if preload_chunks else None
+        self.load_times['sqlite'] = time.perf_counter() - start
+
+        if not lazy_load:
+            self.load_models()
+
+    def _create_tables(self):
+        """
+        Creates the chunks table and the documents manifest, and adds the content_hash
+        column (backfilled from the stored text) to databases written before it existed.
+        Older databases also get an empty embedding column, filled by stored_embeddings().
+        """
+        with self.conn:
+            # Take the write lock before reading the schema, so processes opening the same
+            # database at once migrate it one after the other instead of adding columns twice
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    document TEXT NOT NULL,
+                    section TEXT NOT NULL,
+                    content_hash TEXT,
+                    category TEXT,
+                    source_url TEXT,
+                    scraped_date TEXT,
+                    embedding BLOB)
+                ''')
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(chunks)")]
+            if 'content_hash' not in columns:
+                self.conn.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+                rows = self.conn.execute("SELECT id, text FROM chunks").fetchall()
+                self.conn.executemany("UPDATE chunks SET content_hash = ? WHERE id = ?",
+                                      [(content_hash(text), chunk_id) for chunk_id, text in rows])
+                print(f"✓ Added content hashes to {len(rows)} existing chunks")
+            for column in METADATA_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+            if 'embedding' not in columns:
+                self.conn.execute("ALTER TABLE chunks ADD COLUMN embedding BLOB")
+            # Indexes for metadata-filtered retrieval (select_chunk_ids)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_section ON chunks (section)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_category ON chunks (category)")
+
+            # Manifest of ingested source files, so unchanged files are skipped without re-chunking
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                    document TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    chunking TEXT NOT NULL)
+                ''')
+
+            # BM25 index over character n-grams, alongside chunks
+            indexed = lexical.create_fts_table(self.conn)
+            if indexed:
+                print(f"✓ Built full-text index for {indexed} chunks")
+        self.has_fts = True
+
+    def _configure(self, *, dimension, embedding_model, model_name, enable_translation, mode,
+                   query_cache_size, query_cache_path,
+                   answer_cache_size, answer_cache_threshold, answer_cache_ttl,
+                   translation_cache_path, use_prefix_cache,
+                   context_token_budget, context_max_distance, context_dedup_threshold,
+                   corpus_language, search_mode, lexical_fast_path, hybrid_candidates,
+                   rerank_factor, embedding_backend, embedding_min_cosine,
+                   llm_dtype, llm_quantization, torch_threads,
+                   translation_num_beams, translation_length_ratio, translation_max_input_tokens,
+                   translation_quantization):
+        """
+        Settings and caches shared by __init__ and load_from_saved. No model is loaded here.
+        Keyword-only, so a setting added to one caller cannot shift the others into the wrong slot.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        if corpus_language not in CORPUS_LANGUAGES:
+            raise ValueError(f"corpus_language must be one of {CORPUS_LANGUAGES}, got {corpus_language!r}")
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"search_mode must be one of {SEARCH_MODES}, got {search_mode!r}")
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"embedding_backend must be one of {EMBEDDING_BACKENDS}, got {embedding_backend!r}")
+
+        self.system_prompt = "You are a medical assistant. Give answers to the questions using your knowledge in combination with retrieved information"
+        self.mode = mode
+        self.model_name = model_name
+        self.dimension = dimension
+        self.embedding_model_name = embedding_model
+        # 'int8' / 'onnx' embed queries on CPU faster; they are checked against fp32 on load
+        # and replaced by the fp32 model if any cosine similarity drops below embedding_min_cosine
+        self.embedding_backend = embedding_backend
+        self.embedding_min_cosine = embedding_min_cosine
+        self.embedding_agreement = None
 
+        # LLM precision: 'auto' is fp16 on GPU and bf16 / fp32 on CPU; llm_quantization='int8'
+        # dynamically quantizes the Linear layers on CPU. The dtype is checked here, before any load.
+        self.llm_dtype, self.llm_device_map = resolve_dtype(llm_dtype, llm_quantization)
+        self.llm_quantization = llm_quantization
+        self.torch_threads = set_threads(torch_threads)
+        self.corpus_language = corpus_language
         self.context = []
-        
-        # Translation setup
-        self.enable_translation = enable_translation
-        if enable_translation:
-            print("Loading translation models...")
-            
-            # English → Chinese
-            self.en_zh_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-en-zh")
-            self.en_zh_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-en-zh")
-            print("✓ Loaded EN→ZH translator")
-            
-            # Chinese → English
-            self.zh_en_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-zh-en")
-            self.zh_en_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-zh-en")
-            print("✓ Loaded ZH→EN translator")
+        # Filter -> allowed chunk ids, cleared whenever chunks are added or removed
+        self._filter_ids = {}
+
+        # Retrieval: default search mode, BM25-only answers for short keyword queries,
+        # and how many candidates each ranker contributes to hybrid fusion
+        self.search_mode = search_mode
+        self.lexical_fast_path = lexical_fast_path
+        self.hybrid_candidates = hybrid_candidates
+        self.has_fts = False
+        # Compressed (SQ/PQ) indexes: search k * rerank_factor candidates and re-rank them
+        # exactly against the original embeddings stored in SQLite (None = no re-ranking)
+        self.rerank_factor = rerank_factor
+
+        # Models are loaded on first use (see the properties below)
+        self._model = None
+        self._tokenizer = None
+        self._embedding_model = None
+        self._translators = {}
+        self._load_lock = threading.RLock()
+        self.load_times = {}
+        self.warmup_times = {}
+        self.read_only = False
+
+        # KV cache of the prompt prefix shared by every request (system prompt + user header)
+        self.use_prefix_cache = use_prefix_cache
+        self._prefix_cache = None
+        self.prefix_cache_stats = {}
+
+        # Context packing: fill a token budget with the most query-relevant sentences (None = whole hits)
+        self.context_token_budget = context_token_budget
+        self.context_max_distance = context_max_distance
+        self.context_dedup_threshold = context_dedup_threshold
+        self.last_packing_stats = {}
+
+        # Caches (vectors of a quantized backend are not mixed with persisted fp32 ones)
+        cache_key = embedding_model if embedding_backend == 'torch' else f"{embedding_model}:{embedding_backend}"
+        self.query_cache = EmbeddingCache(cache_key, max_size=query_cache_size, path=query_cache_path)
+        self.sentence_cache = EmbeddingCache(cache_key, max_size=4096)
+        # The answer cache is opt-in (answer_cache_size > 0): a 0.95 cosine match between two medical
+        # questions can still differ in a detail that changes the answer (drug, dose, age group), and
+        # the threshold has not been validated against labelled question pairs for this corpus
+        self.answer_cache = SemanticCache(dimension, threshold=answer_cache_threshold,
+                                          max_size=answer_cache_size, ttl=answer_cache_ttl)
+
+        # Translation is never used in retrieval mode
+        self.enable_translation = enable_translation and mode == 'full'
+        # Marian decoding: num_beams None keeps the model's beam search, 1 is greedy; outputs are
+        # capped relative to the input length, and 'int8' quantizes the Linear layers on CPU
+        if translation_quantization not in QUANTIZATIONS:
+            raise ValueError(f"translation_quantization must be one of {QUANTIZATIONS}, got {translation_quantization!r}")
+        self.translation_num_beams = translation_num_beams
+        self.translation_length_ratio = translation_length_ratio
+        self.translation_max_input_tokens = translation_max_input_tokens
+        self.translation_quantization = translation_quantization
+        self.translation_cache = TranslationCache(translation_cache_path) if translation_cache_path else None
+
+    def _timed_load(self, component, loader):
+        start = time.perf_counter()
+        result = loader()
+        self.load_times[component] = time.perf_counter() - start
+        return result
+
+    def _require_full_mode(self, what):
+        if self.mode != 'full':
+            raise RuntimeError(f"{what} is not available in mode='{self.mode}'")
+
+    def _load_embedding_model(self):
+        model = load_embedding_model(self.embedding_model_name, self.embedding_backend)
+        if self.embedding_backend == 'torch' or not self.embedding_min_cosine:
+            return model
+        reference = load_embedding_model(self.embedding_model_name)
+        self.embedding_agreement = check_agreement(reference, model, min_cosine=self.embedding_min_cosine)
+        if not self.embedding_agreement['passed']:
+            print(f"⚠ WARNING: {self.embedding_backend} embeddings drift from fp32 "
+                  f"(min cosine {self.embedding_agreement['min_cosine']:.4f} < {self.embedding_min_cosine}), "
+                  f"using the fp32 model")
+            return reference
+        print(f"✓ {self.embedding_backend} embeddings agree with fp32 "
+              f"(min cosine {self.embedding_agreement['min_cosine']:.4f})")
+        return model
+
+    @property
+    def embedding_model(self):
+        with self._load_lock:
+            if self._embedding_model is None:
+                self._embedding_model = self._timed_load('embedding_model', self._load_embedding_model)
+                print(f"✓ Loaded embedding model {self.embedding_model_name} ({self.embedding_backend})")
+            return self._embedding_model
+
+    def _load_llm(self):
+        self._require_full_mode("The LLM")
+        with self._load_lock:
+            if self._model is None:
+                def load():
+                    model = AutoModelForCausalLM.from_pretrained(
+                        self.model_name,
+                        torch_dtype=self.llm_dtype,
+                        device_map=self.llm_device_map
+                    )
+                    if self.llm_quantization == 'int8':
+                        model = quantize_int8(model)
+                    return model, AutoTokenizer.from_pretrained(self.model_name)
+                self._model, self._tokenizer = self._timed_load('llm', load)
+                precision = 'int8 dynamic' if self.llm_quantization else str(self.llm_dtype).replace('torch.', '')
+                print(f"✓ Loaded LLM {self.model_name} ({precision}, {self._model.device}, "
+                      f"{self.torch_threads} threads)")
+
+    @property
+    def model(self):
+        self._load_llm()
+        return self._model
+
+    @property
+    def tokenizer(self):
+        self._load_llm()
+        return self._tokenizer
+
+    def _translator(self, direction):
+        """(tokenizer, model) for a translation direction, loaded on first use"""
+        self._require_full_mode("Translation")
+        with self._load_lock:
+            if direction not in self._translators:
+                name = TRANSLATION_MODELS[direction]
+
+                def load():
+                    model = MarianMTModel.from_pretrained(name)
+                    if self.translation_quantization == 'int8':
+                        model = quantize_int8(model)
+                    return MarianTokenizer.from_pretrained(name), model
+                self._translators[direction] = self._timed_load(f"translator_{direction}", load)
+                print(f"✓ Loaded {direction.upper().replace('-', '→')} translator"
+                      f"{' (int8)' if self.translation_quantization else ''}")
+            return self._translators[direction]
+
+    def _translation_kwargs(self):
+        kwargs = {'max_length': self.translation_max_input_tokens, 'length_ratio': self.translation_length_ratio}
+        if self.translation_num_beams is not None:
+            kwargs['num_beams'] = self.translation_num_beams
+        return kwargs
+
+    def _translation_cache_key(self):
+        """The decoding settings as a string, so each setting gets its own cached translations"""
+        return json.dumps({**self._translation_kwargs(), 'quantization': self.translation_quantization},
+                          sort_keys=True)
+
+    @property
+    def en_zh_tokenizer(self):
+        return self._translator('en-zh')[0]
+
+    @property
+    def en_zh_model(self):
+        return self._translator('en-zh')[1]
+
+    @property
+    def zh_en_tokenizer(self):
+        return self._translator('zh-en')[0]
+
+    @property
+    def zh_en_model(self):
+        return self._translator('zh-en')[1]
+
+    def load_models(self):
+        """Eagerly load every model the current mode uses"""
+        self.embedding_model
+        if self.mode == 'full':
+            self._load_llm()
+            if self.enable_translation:
+                for direction in TRANSLATION_MODELS:
+                    self._translator(direction)
+
+    def warmup(self):
+        """
+        Load every model the current mode uses and run one dummy pass through each,
+        so the first real request does not pay for lazy loading or first-call overhead
+
+        Returns:
+            dict: component -> warmup seconds
+        """
+        start = time.perf_counter()
+        self.embedding_model.encode(["warmup"])
+        self.warmup_times['embedding_model'] = time.perf_counter() - start
+
+        if self.mode == 'full':
+            if self.enable_translation:
+                for direction, sample in (('en-zh', "Hello."), ('zh-en', "你好。")):
+                    tokenizer, model = self._translator(direction)
+                    start = time.perf_counter()
+                    translate_texts([sample], model, tokenizer, **self._translation_kwargs())
+                    self.warmup_times[f"translator_{direction}"] = time.perf_counter() - start
+
+            inputs = self.tokenizer("warmup", return_tensors="pt").to(self.model.device)
+            start = time.perf_counter()
+            with torch.no_grad():
+                self.model.generate(**inputs, max_new_tokens=1, do_sample=False,
+                                    pad_token_id=self.tokenizer.eos_token_id)
+            self.warmup_times['llm'] = time.perf_counter() - start
+
+        print(f"✓ Warmed up {', '.join(self.warmup_times)}")
+        return dict(self.warmup_times)
+
+    def startup_report(self):
+        """
+        Print and return the time spent loading and warming up each component
+
+        Returns:
+            dict: component -> {'load_s', 'warmup_s'}
+        """
+        components = list(dict.fromkeys([*self.load_times, *self.warmup_times]))
+        report = {
+            name: {'load_s': self.load_times.get(name, 0.0), 'warmup_s': self.warmup_times.get(name, 0.0)}
+            for name in components
+        }
+
+        print("=" * 60)
+        print(f"STARTUP TIME BREAKDOWN (mode={self.mode})")
+        print("=" * 60)
+        print(f"{'Component':<24}{'Load (s)':>12}{'Warmup (s)':>12}{'Total (s)':>12}")
+        for name, times in report.items():
+            print(f"{name:<24}{times['load_s']:>12.2f}{times['warmup_s']:>12.2f}"
+                  f"{times['load_s'] + times['warmup_s']:>12.2f}")
+        total = sum(t['load_s'] + t['warmup_s'] for t in report.values())
+        print(f"{'Total':<24}{'':>24}{total:>12.2f}")
+        lazy_components = [('embedding_model', self._embedding_model)]
+        if self.mode == 'full':
+            lazy_components.append(('llm', self._model))
+        not_loaded = [name for name, loaded in lazy_components if loaded is None]
+        if not_loaded:
+            print(f"Not loaded yet: {', '.join(not_loaded)}")
+        return report
+
+    def translate_batch(self, texts, direction, batch_size=16):
+        """
+        Translate a list of strings sentence by sentence in padded batches, through the translation cache
+
+        Args:
+            texts: List of strings
+            direction: 'en-zh' or 'zh-en'
+            batch_size: Number of sentences per generate call
+        """
+        if not self.enable_translation:
+            return list(texts)
+        tokenizer, model = self._translator(direction)
+        return translate_batch(list(texts), direction, model, tokenizer,
+                               cache=self.translation_cache, batch_size=batch_size,
+                               cache_key=self._translation_cache_key(), **self._translation_kwargs())
+
+    def translate_en_to_zh_batch(self, texts):
+        """Translate a list of English strings to Chinese"""
+        return self.translate_batch(texts, 'en-zh')
+
+    def translate_zh_to_en_batch(self, texts):
+        """Translate a list of Chinese strings to English"""
+        return self.translate_batch(texts, 'zh-en')
 
     def translate_en_to_zh(self, text):
         """Translate English to Chinese"""
-        if not self.enable_translation:
-            return text
-        inputs = self.en_zh_tokenizer(text, return_tensors="pt", padding=True)
-        translated = self.en_zh_model.generate(**inputs)
-        result = self.en_zh_tokenizer.decode(translated[0], skip_special_tokens=True)
-        return result
+        return self.translate_batch([text], 'en-zh')[0]
     
     def translate_zh_to_en(self, text):
         """Translate Chinese to English"""
-        if not self.enable_translation:
-            return text
-        inputs = self.zh_en_tokenizer(text, return_tensors="pt", padding=True)
-        translated = self.zh_en_model.generate(**inputs)
-        result = self.zh_en_tokenizer.decode(translated[0], skip_special_tokens=True)
-        return result
+        return self.translate_batch([text], 'zh-en')[0]
+
+    def _require_writable(self):
+        if self.read_only:
+            raise RuntimeError("This RAG was loaded read-only (mmap=True); rebuild or reload it to add chunks")
 
     def add_chunk(self, text):
-        embed_add(text, self.embedding_model, self.faiss_index, self.cursor)
+        self._require_writable()
+        chunk_id = embed_add(text, self.embedding_model, self.faiss_index, self.cursor)
+        if self.has_fts:
+            lexical.index_chunks(self.conn, [chunk_id], [text['text']])
+        self.answer_cache.invalidate()
+        self._filter_ids.clear()
+        if self.chunk_store is not None:
+            self.chunk_store[chunk_id] = chunk_row(chunk_id, text)
 
-    def query_chunks(self, user_query):
-        self.context = vectorize_query_retrieve(
-            user_query,
-            self.embedding_model,
-            self.faiss_index,
-            self.cursor)
-        return self.context
+    def add_chunks(self, chunks, batch_size=64):
+        """
+        Bulk version of add_chunk: encodes chunks in batches, adds whole matrices
+        to FAISS and inserts each batch with executemany inside one transaction
 
-    def llm_generate(self, query, source_language='en'):
+        Args:
+            chunks: Iterable of chunk dicts with 'text', 'document' and 'section' keys
+            batch_size: Number of chunks encoded and inserted per batch
+
+        Returns:
+            int: Number of chunks added
         """
-        Generate response with optional translation
-        
+        self._require_writable()
+        total = 0
+        start = time.perf_counter()
+
+        # IVF / PQ indexes must be trained before anything is added: encode everything
+        # once, train on it and reuse the same vectors for the inserts
+        vectors = None
+        if not self.faiss_index.is_trained:
+            chunks = list(chunks)
+            vectors = self.embedding_model.encode([chunk['text'] for chunk in chunks], batch_size=batch_size)
+            vectors = np.asarray(vectors, dtype='float32')
+            train_index(self.faiss_index, vectors)
+        chunks = iter(chunks)
+        added = {}
+        added_ids = []
+
+        try:
+            with self.conn:  # one transaction, committed on success and rolled back on error
+                while True:
+                    batch = list(islice(chunks, batch_size))
+                    if not batch:
+                        break
+                    batch_vectors = None if vectors is None else vectors[total:total + len(batch)]
+                    ids = embed_add_batch(batch, self.embedding_model, self.faiss_index, self.cursor,
+                                          batch_size, vectors=batch_vectors)
+                    added_ids.extend(ids)
+                    if self.has_fts:
+                        lexical.index_chunks(self.conn, ids, [chunk['text'] for chunk in batch])
+                    if self.chunk_store is not None:
+                        for chunk_id, chunk in zip(ids, batch):
+                            added[chunk_id] = chunk_row(chunk_id, chunk)
+                    total += len(batch)
+                    print(f"  Added {total} chunks...", end="\r")
+        except BaseException:
+            # The rollback only undoes SQLite; drop the vectors of earlier batches from FAISS too,
+            # or the next insert would reuse their ids for different chunks
+            if added_ids:
+                print(f"\n⚠ Adding chunks failed, removing {len(added_ids)} vectors from the index")
+                self.faiss_index = remove_ids(self.faiss_index, added_ids, self.index_factory)
+            raise
+
+        # Only publish to the in-memory store once the transaction has committed
+        if self.chunk_store is not None:
+            self.chunk_store.update(added)
+        # Cached answers may be missing the new chunks
+        self.answer_cache.invalidate()
+        self._filter_ids.clear()
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"✓ Added {total} chunks in {elapsed:.1f}s ({rate:.1f} chunks/sec)")
+        return total
+
+    def remove_chunks(self, ids):
+        """
+        Deletes chunks by id from SQLite, FAISS and the in-memory store
+
         Args:
-            query: Question in English or Chinese
-            source_language: 'en' or 'zh' - language of the input query
+            ids: Chunk ids to delete
+
+        Returns:
+            int: Number of chunks removed
+        """
+        self._require_writable()
+        ids = list(ids)
+        if not ids:
+            return 0
+        with self.conn:
+            for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+                part = ids[start:start + SQLITE_MAX_PARAMS]
+                self.conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+            if self.has_fts:
+                lexical.delete_chunks(self.conn, ids)
+        self.faiss_index = remove_ids(self.faiss_index, ids, self.index_factory)
+        if self.chunk_store is not None:
+            for chunk_id in ids:
+                self.chunk_store.pop(chunk_id, None)
+        self.answer_cache.invalidate()
+        self._filter_ids.clear()
+        return len(ids)
+
+    def sync_documents(self, json_folder='Json_files', strategy='section', max_tokens=256, overlap=32,
+                       batch_size=64):
         """
-        # Step 1: Translate query to Chinese if needed
-        if source_language == 'en' and self.enable_translation:
-            chinese_query = self.translate_en_to_zh(query)
-            print(f"Original Query (EN): {query}")
-            print(f"Translated Query (ZH): {chinese_query}")
+        Incrementally brings the index in line with a folder of JSON documents. Files whose
+        size, mtime and hash match the manifest are skipped; changed files are re-chunked and
+        only chunks with a new content hash are embedded, while stale chunks are removed by id.
+        Stale chunks are removed first, then new chunks are streamed file by file into add_chunks,
+        so only the positions of the chunks to embed are kept in memory, not the corpus.
+
+        Args:
+            json_folder: Folder of document JSON files
+            strategy, max_tokens, overlap: Chunking settings (see chunking.create_chunks_from_json);
+                changing them re-chunks every document
+            batch_size: Encoding batch size for new chunks
+
+        Returns:
+            dict: Counts of unchanged/changed/new/removed documents and added/kept/removed chunks
+
+        Raises:
+            FileNotFoundError: If json_folder does not exist
+            ValueError: If it holds no JSON files while documents are indexed (nothing is removed)
+        """
+        from chunking import create_chunks_from_json
+
+        self._require_writable()
+        start = time.perf_counter()
+        chunking = json.dumps({'strategy': strategy, 'max_tokens': max_tokens, 'overlap': overlap}, sort_keys=True)
+        manifest = {row[0]: row[1:] for row in self.conn.execute(
+            "SELECT document, content_hash, size, mtime, chunking FROM documents")}
+
+        # A missing or mistyped folder would otherwise look like every document was deleted
+        if not Path(json_folder).is_dir():
+            raise FileNotFoundError(f"Document folder not found: {json_folder}")
+        paths = sorted(Path(json_folder).glob('*.json'))
+        if not paths and manifest:
+            raise ValueError(f"No JSON documents in {json_folder}; refusing to remove all "
+                             f"{len(manifest)} indexed documents")
+
+        stats = {'unchanged': 0, 'changed': 0, 'new': 0, 'removed': 0,
+                 'chunks_added': 0, 'chunks_kept': 0, 'chunks_removed': 0}
+        to_add, to_remove, manifest_rows, seen = [], [], [], set()  # to_add: (path, chunk positions)
+
+        for path in paths:
+            document = path.stem
+            seen.add(document)
+            stat = path.stat()
+            entry = manifest.get(document)
+            if entry is not None and entry[1:] == (stat.st_size, stat.st_mtime, chunking):
+                stats['unchanged'] += 1
+                continue
+
+            file_hash = content_hash(path.read_bytes())
+            row = (document, str(path), file_hash, stat.st_size, stat.st_mtime)
+            if entry is not None and entry[0] == file_hash and entry[3] == chunking:
+                # Touched but identical: only refresh size/mtime in the manifest
+                stats['unchanged'] += 1
+                manifest_rows.append(row + (None, chunking))
+                continue
+            stats['changed' if entry is not None else 'new'] += 1
+
+            # Match new chunks against stored ones by content hash; only unmatched ones are embedded
+            stored = {}
+            for chunk_id, chunk_hash in self.conn.execute(
+                    "SELECT id, content_hash FROM chunks WHERE document = ? ORDER BY id", (document,)):
+                stored.setdefault(chunk_hash, []).append(chunk_id)
+            chunks = create_chunks_from_json(path, strategy, max_tokens, overlap)
+            positions = []
+            for position, chunk in enumerate(chunks):
+                matches = stored.get(content_hash(chunk['text']))
+                if matches:
+                    matches.pop(0)
+                    stats['chunks_kept'] += 1
+                else:
+                    positions.append(position)
+            if positions:
+                to_add.append((path, positions))
+            to_remove.extend(chunk_id for ids in stored.values() for chunk_id in ids)
+            manifest_rows.append(row + (len(chunks), chunking))
+
+        # Documents whose file disappeared
+        for document in manifest.keys() - seen:
+            stats['removed'] += 1
+            to_remove.extend(row[0] for row in self.conn.execute(
+                "SELECT id FROM chunks WHERE document = ?", (document,)))
+
+        def new_chunks():
+            # Re-chunks one changed file at a time (chunking is deterministic) instead of holding them all
+            for path, positions in to_add:
+                chunks = create_chunks_from_json(path, strategy, max_tokens, overlap)
+                for position in positions:
+                    yield chunks[position]
+
+        stats['chunks_removed'] = self.remove_chunks(to_remove)
+        if to_add:
+            stats['chunks_added'] = self.add_chunks(new_chunks(), batch_size=batch_size)
+
+        # The manifest is written last, so an interrupted sync redoes the affected files
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM documents WHERE document = ?", [(document,) for document in manifest.keys() - seen])
+            self.conn.executemany('''
+                INSERT INTO documents (document, path, content_hash, size, mtime, chunk_count, chunking)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, 0), ?)
+                ON CONFLICT (document) DO UPDATE SET
+                    path = excluded.path, content_hash = excluded.content_hash, size = excluded.size,
+                    mtime = excluded.mtime, chunking = excluded.chunking,
+                    chunk_count = CASE WHEN ? IS NULL THEN documents.chunk_count ELSE excluded.chunk_count END
+                ''', [row + (row[5],) for row in manifest_rows])
+
+        elapsed = time.perf_counter() - start
+        print(f"✓ Synced {json_folder} in {elapsed:.1f}s: {stats['new']} new, {stats['changed']} changed, "
+              f"{stats['unchanged']} unchanged, {stats['removed']} removed documents; "
+              f"{stats['chunks_added']} chunks embedded, {stats['chunks_kept']} kept, "
+              f"{stats['chunks_removed']} removed")
+        return stats
+
+    def stored_embeddings(self, batch_size=64):
+        """
+        The original float32 embeddings of every chunk, as stored in SQLite. Chunks added
+        before embeddings were stored are encoded now (and saved, unless read-only).
+
+        Returns:
+            tuple: (ids as an int64 array, float32 matrix of shape (n, dimension)), ordered by id
+        """
+        rows = self.conn.execute("SELECT id, text, embedding FROM chunks ORDER BY id").fetchall()
+        vectors = np.zeros((len(rows), self.dimension), dtype='float32')
+        missing = []
+        for i, row in enumerate(rows):
+            if row[2] is None:
+                missing.append(i)
+            else:
+                vectors[i] = np.frombuffer(row[2], dtype='float32')
+        if missing:
+            print(f"Encoding {len(missing)} chunks without a stored embedding...")
+            encoded = self.embedding_model.encode([rows[i][1] for i in missing], batch_size=batch_size)
+            vectors[missing] = np.asarray(encoded, dtype='float32')
+            if not self.read_only:
+                with self.conn:
+                    self.conn.executemany("UPDATE chunks SET embedding = ? WHERE id = ?",
+                                          [(vectors[i].tobytes(), rows[i][0]) for i in missing])
+                print(f"✓ Stored embeddings of {len(missing)} chunks")
+        return np.asarray([row[0] for row in rows], dtype='int64'), vectors
+
+    def rebuild_index(self, index_factory, batch_size=64):
+        """
+        Rebuilds the FAISS index from the stored embeddings with another factory string,
+        e.g. to switch a flat index to compressed storage ('SQ8', 'SQ4', 'PQ96'; see
+        index_factory.compressed_factory). Save with save_databases afterwards.
+
+        Args:
+            index_factory: FAISS factory string of the new index
+            batch_size: Encoding batch size for chunks without a stored embedding
+
+        Returns:
+            dict: Serialized size in bytes of the old and the new index
+        """
+        self._require_writable()
+        ids, vectors = self.stored_embeddings(batch_size=batch_size)
+        old_bytes = index_size_bytes(self.faiss_index)
+
+        index = create_index(self.dimension, index_factory)
+        copy_search_params(self.faiss_index, index)
+        train_index(index, vectors)
+        index.add_with_ids(vectors, ids)
+        self.faiss_index = index
+        self.index_factory = index_factory
+
+        new_bytes = index_size_bytes(index)
+        print(f"✓ Rebuilt index as {index_factory}: {old_bytes / 1024 ** 2:.2f} MB -> {new_bytes / 1024 ** 2:.2f} MB")
+        return {'old_bytes': old_bytes, 'new_bytes': new_bytes}
+
+    def auto_tune_index(self, queries=None, k=3, target_recall=0.95, n_queries=200, batch_size=64):
+        """
+        Picks the fastest nprobe / efSearch meeting a target recall@k against an exact flat index
+
+        Args:
+            queries: Optional list of query strings; defaults to a sample of stored chunk texts
+            k: Number of neighbours for recall@k
+            target_recall: Minimum recall@k the chosen setting must reach
+            n_queries: Number of chunk texts sampled as queries when none are given
+            batch_size: Encoding batch size
+
+        Returns:
+            dict: Chosen setting and the measurement table from index_factory.auto_tune
+        """
+        # Ground truth comes from the original embeddings, since compressed
+        # indexes (SQ, PQ) cannot reconstruct the vectors exactly
+        ids, vectors = self.stored_embeddings(batch_size=batch_size)
+
+        if queries is None:
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+            query_vectors = vectors[sample]
         else:
-            chinese_query = query
-        
-        # Step 2: Query RAG system (always in Chinese)
-        context = self.query_chunks(chinese_query)
-        context_str = "\n".join(context)
-        
-        # Step 3: Generate response in Chinese
+            query_vectors = np.asarray(self.embedding_model.encode(queries, batch_size=batch_size), dtype='float32')
+
+        return auto_tune(self.faiss_index, vectors, query_vectors, k=k, target_recall=target_recall, ids=ids)
+
+    def encode_queries(self, queries, batch_size=64):
+        """Encode query strings through the LRU query-embedding cache"""
+        return self.query_cache.encode(list(queries), self.embedding_model, batch_size=batch_size)
+
+    def query_cache_stats(self):
+        """Hit/miss counters of the query-embedding cache"""
+        return self.query_cache.stats()
+
+    def query_chunks(self, user_query, **filters):
+        """Texts of the top chunks for one query; same search as query_chunks_batch (search_mode, re-ranking, filters)"""
+        self.context = [hit['text'] for hit in self.query_chunks_batch([user_query], **filters)[0]]
+        return self.context
+
+    def chunk_ids(self, document=None, section=None, category=None):
+        """
+        Chunk ids matching metadata filters (a value or a list of values per field), cached per filter
+
+        Returns:
+            np.ndarray: Matching ids, or None when no filter is set
+        """
+        filters = {'document': document, 'section': section, 'category': category}
+        key = tuple((column, value if isinstance(value, str) else tuple(value))
+                    for column, value in filters.items() if value is not None)
+        if not key:
+            return None
+        ids = self._filter_ids.get(key)
+        if ids is None:
+            ids = select_chunk_ids(self.conn.cursor(), self.chunk_store, **filters)
+            self._filter_ids[key] = ids
+        return ids
+
+    def query_chunks_batch(self, queries, k=3, batch_size=64, document=None, section=None, category=None,
+                           search_mode=None):
+        """
+        Retrieve chunks for many queries with one encode call, one FAISS search and one SQL query
+
+        Args:
+            queries: List of query strings (in the corpus language)
+            k: Number of chunks per query
+            batch_size: Encoding batch size
+            document, section, category: Optional metadata filters, each a value or a list of values
+                (e.g. section='治疗'). They are applied inside the FAISS search, so k hits are
+                returned whenever k matching chunks exist.
+            search_mode: 'vector', 'lexical' or 'hybrid' (defaults to self.search_mode). In hybrid
+                mode, short keyword queries with k BM25 hits skip the embedding model when
+                self.lexical_fast_path is set.
+
+        Returns:
+            list: Per query, a ranked list of dicts with 'id', 'text', 'document', 'section' and 'distance'
+            (inf for chunks found only lexically); lexical and hybrid hits also carry 'bm25' / 'rrf_score'
+        """
+        queries = list(queries)
+        search_mode = search_mode or self.search_mode
+        ids = self.chunk_ids(document, section, category)
+        cursor = self.conn.cursor()  # own cursor, so streaming / serving threads can retrieve concurrently
+        if search_mode == 'vector' or not self.has_fts:
+            return self._vector_search(queries, k, batch_size, ids, cursor)
+
+        n_candidates = k if search_mode == 'lexical' else max(k, self.hybrid_candidates)
+        lexical_hits = lexical.lexical_search(cursor, queries, n_candidates, ids)
+        results = [None] * len(queries)
+        dense = []
+        for i, (query, ranked) in enumerate(zip(queries, lexical_hits)):
+            fast = self.lexical_fast_path and lexical.is_keyword_query(query) and len(ranked) >= k
+            if search_mode == 'lexical' or fast:
+                results[i] = [(chunk_id, {'bm25': score}) for chunk_id, score in ranked[:k]]
+            else:
+                dense.append(i)
+
+        if dense:
+            vector_hits = self._vector_search([queries[i] for i in dense], n_candidates, batch_size, ids, cursor)
+            for i, hits in zip(dense, vector_hits):
+                distances = {hit['id']: hit['distance'] for hit in hits}
+                bm25 = dict(lexical_hits[i])
+                fused = lexical.reciprocal_rank_fusion([[hit['id'] for hit in hits], [c for c, _ in lexical_hits[i]]])
+                results[i] = [(chunk_id, {'rrf_score': score, 'distance': distances.get(chunk_id, float('inf')),
+                                          **({'bm25': bm25[chunk_id]} if chunk_id in bm25 else {})})
+                              for chunk_id, score in fused[:k]]
+
+        rows = lookup_chunks([chunk_id for ranked in results for chunk_id, _ in ranked], cursor, self.chunk_store)
+        return [[{**rows[chunk_id], 'distance': float('inf'), **extra}
+                 for chunk_id, extra in ranked if chunk_id in rows]
+                for ranked in results]
+
+    def _vector_search(self, queries, k, batch_size, ids, cursor):
+        return vectorize_queries_retrieve_batch(
+            queries,
+            self.embedding_model,
+            self.faiss_index,
+            cursor,
+            k=k,
+            batch_size=batch_size,
+            chunk_store=self.chunk_store,
+            query_vectors=self.encode_queries(queries, batch_size=batch_size) if queries else None,
+            ids=ids,
+            rerank_factor=self.rerank_factor)
+
+    def _cache_vectors(self, queries):
+        """Source-language query embeddings for the answer cache, or Nones when it is disabled"""
+        if not self.answer_cache.enabled:
+            return [None] * len(queries)
+        return self.encode_queries(queries)
+
+    def _answer_from_cache(self, query, query_vector, source_language):
+        """Returns a cached answer (restoring self.context) or None"""
+        if query_vector is None:
+            return None
+        cached = self.answer_cache.lookup(query_vector, source_language)
+        if cached is None:
+            return None
+        rows = lookup_chunks(cached['context_ids'], self.conn.cursor(), self.chunk_store)
+        self.context = [rows[i]['text'] for i in cached['context_ids'] if i in rows]
+        print(f"✓ Answer cache hit (similarity {cached['similarity']:.3f} to '{cached['query']}')")
+        return cached['answer']
+
+    def _translates(self, source_language):
+        """Queries in another language than the corpus are translated there and back"""
+        return source_language != self.corpus_language and self.enable_translation
+
+    def _query_direction(self, source_language):
+        return f"{source_language}-{self.corpus_language}"
+
+    def _response_direction(self, source_language):
+        return f"{self.corpus_language}-{source_language}"
+
+    def _to_corpus_query(self, query, source_language):
+        if self._translates(source_language):
+            corpus_query = self.translate_batch([query], self._query_direction(source_language))[0]
+            print(f"Original Query ({source_language.upper()}): {query}")
+            print(f"Translated Query ({self.corpus_language.upper()}): {corpus_query}")
+            return corpus_query
+        return query
+
+    def _retrieve_context(self, corpus_query):
+        """Retrieve the hits for one query (in the corpus language) and expose their texts as self.context"""
+        hits = self.query_chunks_batch([corpus_query])[0]
+        self.context = [hit['text'] for hit in hits]
+        for hit in hits:
+            print(f"Distance: {hit['distance']:.4f} | {hit['document']} / {hit['section']}")
+        return hits
+
+    def _count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def _encode_sentences(self, sentences, batch_size=64):
+        """Encode context sentences through their own LRU cache, so they do not evict query vectors"""
+        return self.sentence_cache.encode(list(sentences), self.embedding_model, batch_size=batch_size)
+
+    def _pack_context(self, corpus_query, hits):
+        """
+        Context string for the prompt. With a token budget, only the most query-relevant,
+        non-duplicate sentences of the hits are kept; self.last_packing_stats records the savings.
+        """
+        if self.context_token_budget is None:
+            self.last_packing_stats = {}
+            return "\n".join(hit['text'] for hit in hits)
+
+        context_str, self.last_packing_stats = pack_context(
+            self.encode_queries([corpus_query])[0], hits, self._encode_sentences, self._count_tokens,
+            token_budget=self.context_token_budget, max_distance=self.context_max_distance,
+            dedup_threshold=self.context_dedup_threshold)
+        stats = self.last_packing_stats
+        print(f"✓ Packed context: {stats['original_tokens']} → {stats['packed_tokens']} tokens "
+              f"({stats['sentences_kept']}/{stats['sentences_total']} sentences, "
+              f"{stats['hits_dropped']} hits over the distance threshold)")
+        return context_str
+
+    def _build_prompt(self, corpus_query, hits):
+        """Chat-template prompt text for a query and its retrieved hits"""
+        context_str = self._pack_context(corpus_query, hits)
         messages = [
             {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": f"Context: {context_str}\n\nQuestion: {chinese_query}"}
+            {"role": "user", "content": f"Context: {context_str}\n\nQuestion: {corpus_query}"}
+        ]
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def _prompt_prefix(self):
+        """Chat-template text every prompt starts with: the system turn and the user-turn header"""
+        marker = "\x00"
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": marker}
         ]
-        
         text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return text.split(marker)[0]
+
+    def _get_prefix_cache(self):
+        """(prefix token ids, past_key_values) of the shared prompt prefix, computed once per system prompt"""
+        prefix = self._prompt_prefix()
+        with self._load_lock:
+            if self._prefix_cache is None or self._prefix_cache[0] != prefix:
+                start = time.perf_counter()
+                prefix_inputs = self.tokenizer(prefix, return_tensors="pt", add_special_tokens=False).to(self.model.device)
+                with torch.no_grad():
+                    past_key_values = self.model(**prefix_inputs, past_key_values=DynamicCache(),
+                                                 use_cache=True).past_key_values
+                self._prefix_cache = (prefix, prefix_inputs['input_ids'], past_key_values)
+                self.prefix_cache_stats = {
+                    'prefix_tokens': prefix_inputs['input_ids'].shape[1],
+                    'build_s': time.perf_counter() - start,
+                }
+                print(f"✓ Cached KV for the {self.prefix_cache_stats['prefix_tokens']}-token prompt prefix")
+            return self._prefix_cache[1], self._prefix_cache[2]
+
+    def _prepare_inputs(self, text):
+        """
+        Tokenize one prompt. When it starts with the cached prefix, also return a private
+        copy of the prefix KV cache so generate() only prefills the variable part.
+
+        Returns:
+            tuple: (inputs, extra generate kwargs)
+        """
         inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
-        
-        outputs = self.model.generate(
-            **inputs,
+        if not self.use_prefix_cache:
+            return inputs, {}
+
+        prefix_ids, past_key_values = self._get_prefix_cache()
+        n_prefix = prefix_ids.shape[1]
+        input_ids = inputs['input_ids']
+        if input_ids.shape[1] > n_prefix and torch.equal(input_ids[0, :n_prefix], prefix_ids[0]):
+            # generate() extends the cache in place, so every request gets its own copy
+            return inputs, {'past_key_values': copy.deepcopy(past_key_values)}
+        return inputs, {}
+
+    def _generation_kwargs(self):
+        return dict(
             max_new_tokens=200,
             temperature=0.7,
             top_p=0.9,
             do_sample=True,
             pad_token_id=self.tokenizer.eos_token_id
         )
+
+    @staticmethod
+    def _clean_response(response):
+        # Clean up to get just the assistant's response
+        if "assistant\n" in response:
+            response = response.split("assistant\n")[-1]
+        return response.strip()
+
+    def llm_generate(self, query, source_language='en'):
+        """
+        Generate response with optional translation
         
-        chinese_response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        Args:
+            query: Question in English or Chinese
+            source_language: 'en' or 'zh' - language of the input query
+        """
+        self._require_full_mode("llm_generate")
+
+        # Step 0: Answer from the semantic cache if a near-identical question was already answered
+        query_vector = self._cache_vectors([query])[0]
+        cached = self._answer_from_cache(query, query_vector, source_language)
+        if cached is not None:
+            return cached
+
+        # Step 1: Translate query to the corpus language if needed
+        corpus_query = self._to_corpus_query(query, source_language)
         
-        # Clean up to get just the assistant's response
-        if "assistant\n" in chinese_response:
-            chinese_response = chinese_response.split("assistant\n")[-1].strip()
+        # Step 2: Query RAG system (always in the corpus language)
+        hits = self._retrieve_context(corpus_query)
         
-        print(f"\nResponse (Chinese):\n{chinese_response}\n")
+        # Step 3: Generate response in the corpus language
+        text = self._build_prompt(corpus_query, hits)
+        inputs, cache_kwargs = self._prepare_inputs(text)
         
-        # Step 4: Translate response to English if needed
-        if source_language == 'en' and self.enable_translation:
-            english_response = self.translate_zh_to_en(chinese_response)
-            print(f"Response (English):\n{english_response}\n")
-            return english_response
-            
+        outputs = self.model.generate(**inputs, **cache_kwargs, **self._generation_kwargs())
+        
+        corpus_response = self._clean_response(self.tokenizer.decode(outputs[0], skip_special_tokens=True))
+        
+        print(f"\nResponse ({self.corpus_language.upper()}):\n{corpus_response}\n")
+        
+        # Step 4: Translate response back to the query language if needed
+        if self._translates(source_language):
+            translated_response = self.translate_batch([corpus_response], self._response_direction(source_language))[0]
+            print(f"Response ({source_language.upper()}):\n{translated_response}\n")
+            response = translated_response
         else:
-            return chinese_response
+            response = corpus_response
+
+        self.answer_cache.store(query_vector, query, response, [hit['id'] for hit in hits], source_language)
+        return response
+
+    def _generate_batch(self, prompts, batch_size=8):
+        """
+        Generate for many prompts in left-padded micro-batches. Prompts are sorted by
+        token length first, so each micro-batch pads to a similar length.
+
+        Returns:
+            tuple: (cleaned responses in prompt order, stats dict)
+        """
+        tokenizer = self.tokenizer
+        generation_kwargs = self._generation_kwargs()
+        lengths = [len(ids) for ids in tokenizer(prompts, add_special_tokens=False)['input_ids']]
+        order = sorted(range(len(prompts)), key=lengths.__getitem__)
+        responses = [None] * len(prompts)
+        padded_tokens = prompt_tokens = generated_tokens = 0
+
+        # Decoder-only models continue from the last position, so padding must go on the left
+        padding_side = tokenizer.padding_side
+        tokenizer.padding_side = 'left'
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        try:
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                inputs = tokenizer([prompts[i] for i in batch], return_tensors="pt",
+                                   padding=True, add_special_tokens=False).to(self.model.device)
+                prompt_length = inputs['input_ids'].shape[1]
+                padded_tokens += prompt_length * len(batch)
+                prompt_tokens += sum(lengths[i] for i in batch)
+
+                with torch.no_grad():
+                    outputs = self.model.generate(**inputs, **generation_kwargs)
+                new_tokens = outputs[:, prompt_length:]
+                generated_tokens += int((new_tokens != generation_kwargs['pad_token_id']).sum())
+                for i, text in zip(batch, tokenizer.batch_decode(new_tokens, skip_special_tokens=True)):
+                    responses[i] = self._clean_response(text)
+        finally:
+            tokenizer.padding_side = padding_side
+
+        stats = {
+            'micro_batches': -(-len(prompts) // batch_size),
+            'prompt_tokens': prompt_tokens,
+            'padding_waste': 1 - prompt_tokens / padded_tokens if padded_tokens else 0.0,
+            'generated_tokens': generated_tokens,
+        }
+        return responses, stats
+
+    def llm_generate_batch(self, queries, source_language='en', batch_size=8):
+        """
+        Batched llm_generate: query translation, retrieval, generation and response
+        translation each run once over the whole list instead of once per query
+
+        Args:
+            queries: List of questions in English or Chinese
+            source_language: 'en' or 'zh' - language of the input queries
+            batch_size: Number of prompts per generate call
+
+        Returns:
+            list: Responses in query order. self.contexts holds each query's retrieved texts
+            and self.last_batch_stats the throughput of the call.
+        """
+        self._require_full_mode("llm_generate_batch")
+        start = time.perf_counter()
+        queries = list(queries)
+        responses = [None] * len(queries)
+        self.contexts = [[] for _ in queries]
+        if not queries:
+            return []
+
+        # Step 0: Serve what we can from the semantic cache
+        query_vectors = self._cache_vectors(queries)
+        todo = []
+        for i, (query, query_vector) in enumerate(zip(queries, query_vectors)):
+            cached = self._answer_from_cache(query, query_vector, source_language)
+            if cached is None:
+                todo.append(i)
+            else:
+                responses[i] = cached
+                self.contexts[i] = self.context
+
+        stats = {'micro_batches': 0, 'prompt_tokens': 0, 'padding_waste': 0.0, 'generated_tokens': 0,
+                 'context_tokens_saved': []}
+        if todo:
+            pending = [queries[i] for i in todo]
+            translate = self._translates(source_language)
+
+            # Step 1: Translate all queries to the corpus language in one batch
+            corpus_queries = self.translate_batch(pending, self._query_direction(source_language)) if translate else pending
+
+            # Step 2: One retrieval pass for every query
+            all_hits = self.query_chunks_batch(corpus_queries)
+
+            # Step 3: Generate in padded micro-batches
+            if self.context_token_budget is not None:
+                # Encode every context sentence in one call; packing then reads them from the cache
+                self._encode_sentences(dict.fromkeys(
+                    sentence for hits in all_hits for hit in hits for _, sentence in chunk_sentences(hit['text'])))
+            prompts = []
+            tokens_saved = []
+            for corpus_query, hits in zip(corpus_queries, all_hits):
+                prompts.append(self._build_prompt(corpus_query, hits))
+                tokens_saved.append(self.last_packing_stats.get('tokens_saved', 0))
+            corpus_responses, stats = self._generate_batch(prompts, batch_size)
+            stats['context_tokens_saved'] = tokens_saved
+
+            # Step 4: Translate all responses back in one batch
+            final_responses = (self.translate_batch(corpus_responses, self._response_direction(source_language))
+                               if translate else corpus_responses)
+
+            for i, hits, response in zip(todo, all_hits, final_responses):
+                responses[i] = response
+                self.contexts[i] = [hit['text'] for hit in hits]
+                self.answer_cache.store(query_vectors[i], queries[i], response,
+                                        [hit['id'] for hit in hits], source_language)
+
+        elapsed = time.perf_counter() - start
+        self.last_batch_stats = {
+            'queries': len(queries),
+            'cached': len(queries) - len(todo),
+            'elapsed_s': elapsed,
+            'queries_per_sec': len(queries) / elapsed if elapsed > 0 else 0.0,
+            'tokens_per_sec': stats['generated_tokens'] / elapsed if elapsed > 0 else 0.0,
+            **stats,
+        }
+        print(f"✓ Generated {len(queries)} responses in {elapsed:.1f}s "
+              f"({self.last_batch_stats['queries_per_sec']:.2f} queries/sec, "
+              f"{self.last_batch_stats['tokens_per_sec']:.1f} tokens/sec, "
+              f"{stats['padding_waste']:.0%} padding)")
+        return responses
+
+    def llm_generate_stream(self, query, source_language='en'):
+        """
+        Streaming variant of llm_generate: a generator that yields the response while the LLM
+        is still generating. Output in the corpus language is yielded token by token; for requests in
+        the other language each completed sentence is translated and yielded as soon as it ends.
+
+        After the generator finishes, self.last_stream_stats holds time-to-first-token and tokens/sec.
+
+        Args:
+            query: Question in English or Chinese
+            source_language: 'en' or 'zh' - language of the input query
+        """
+        self._require_full_mode("llm_generate_stream")
+        start = time.perf_counter()
+
+        query_vector = self._cache_vectors([query])[0]
+        cached = self._answer_from_cache(query, query_vector, source_language)
+        if cached is not None:
+            self.last_stream_stats = {'cached': True, 'time_to_first_token_s': time.perf_counter() - start}
+            yield cached
+            return
+
+        corpus_query = self._to_corpus_query(query, source_language)
+        hits = self._retrieve_context(corpus_query)
+        text = self._build_prompt(corpus_query, hits)
+        inputs, cache_kwargs = self._prepare_inputs(text)
+
+        # generate() runs in a background thread and pushes decoded text into the streamer
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                self.model.generate(**inputs, **cache_kwargs, **self._generation_kwargs(), streamer=streamer)
+            except Exception as e:
+                # generate() only ends the stream when it finishes, so end it here or the loop below blocks forever
+                errors.append(e)
+                streamer.end()
+
+        generation = threading.Thread(target=generate)
+        generate_start = time.perf_counter()
+        generation.start()
+
+        translate = self._translates(source_language)
+        first_token_time = None
+        corpus_pieces = []
+        translated_pieces = []
+        pending = ""
+        for piece in streamer:
+            if not piece:
+                continue
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            corpus_pieces.append(piece)
+            if not translate:
+                yield piece
+                continue
+
+            pending += piece
+            complete, pending = split_complete_sentences(pending)
+            if complete.strip():
+                translated = self.translate_batch([complete.strip()], self._response_direction(source_language))[0]
+                translated += "\n" if complete.endswith("\n") else " "
+                translated_pieces.append(translated)
+                yield translated
+
+        generation.join()
+        if errors:
+            raise errors[0]
+        if translate and pending.strip():
+            translated = self.translate_batch([pending.strip()], self._response_direction(source_language))[0]
+            translated_pieces.append(translated)
+            yield translated
+
+        end = time.perf_counter()
+        corpus_response = self._clean_response("".join(corpus_pieces))
+        n_tokens = len(self.tokenizer(corpus_response, add_special_tokens=False)['input_ids'])
+        decode_time = end - (first_token_time or end)
+        self.last_stream_stats = {
+            'cached': False,
+            'time_to_first_token_s': (first_token_time or end) - start,
+            'generation_time_s': end - generate_start,
+            'tokens': n_tokens,
+            'tokens_per_sec': n_tokens / decode_time if decode_time > 0 else 0.0,
+        }
+        print(f"\n✓ Streamed {n_tokens} tokens, time to first token "
+              f"{self.last_stream_stats['time_to_first_token_s']:.2f}s, "
+              f"{self.last_stream_stats['tokens_per_sec']:.1f} tokens/sec")
+
+        response = "".join(translated_pieces).strip() if translate else corpus_response
+        self.answer_cache.store(query_vector, query, response, [hit['id'] for hit in hits], source_language)
+
+    async def allm_generate_stream(self, query, source_language='en'):
+        """
+        Async iterator over llm_generate_stream: generation runs in a worker thread and
+        pieces are handed to the event loop as they are produced
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for piece in self.llm_generate_stream(query, source_language):
+                    loop.call_soon_threadsafe(queue.put_nowait, piece)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await producer
 
     def commit(self):
         self.conn.commit()
         
     def close(self):
+        self.query_cache.save()
+        if self.translation_cache is not None:
+            self.translation_cache.close()
         self.conn.close()
         
     def save_databases(self, faiss_path='medical_rag.index', 
                     sqlite_path='medical_chunks.db'):
         """Save both FAISS index and SQLite database to files"""
         faiss.write_index(self.faiss_index, faiss_path)
-        print(f"✓ Saved FAISS index to {faiss_path}")
+        save_index_config(faiss_path, self.index_factory, self.faiss_index, self.corpus_language, self.rerank_factor)
+        print(f"✓ Saved FAISS index to {faiss_path} ({self.index_factory}, {get_search_params(self.faiss_index)})")
         
         self.conn.commit()
         print(f"✓ Saved SQLite database to {sqlite_path}")
@@ -159,8 +1316,46 @@ class RAG:
                        sqlite_path='medical_chunks.db',
                        embedding_model='all-MiniLM-L6-v2',
                        model_name="Qwen/Qwen2-1.5B-Instruct",
-                       enable_translation=True):
-        """Load a pre-built RAG system from saved files"""
+                       enable_translation=True,
+                       nprobe=None,
+                       efSearch=None,
+                       preload_chunks=False,
+                       query_cache_size=1024,
+                       query_cache_path=None,
+                       answer_cache_size=0,
+                       answer_cache_threshold=0.95,
+                       answer_cache_ttl=3600,
+                       translation_cache_path='translation_cache.db',
+                       mode='full',
+                       lazy_load=True,
+                       mmap=False,
+                       use_prefix_cache=True,
+                       context_token_budget=768,
+                       context_max_distance=None,
+                       context_dedup_threshold=0.9,
+                       corpus_language=None,
+                       search_mode='vector',
+                       lexical_fast_path=True,
+                       hybrid_candidates=20,
+                       rerank_factor=None,
+                       embedding_backend='torch',
+                       embedding_min_cosine=0.99,
+                       llm_dtype='auto',
+                       llm_quantization=None,
+                       torch_threads=None,
+                       translation_num_beams=None,
+                       translation_length_ratio=2.0,
+                       translation_max_input_tokens=512,
+                       translation_quantization=None):
+        """
+        Load a pre-built RAG system from saved files, optionally overriding the saved search parameters.
+        corpus_language defaults to the one saved with the index ('zh' for indexes saved before it was recorded),
+        rerank_factor to the saved one (pass 0 to turn re-ranking off).
+        Models are loaded on first use unless lazy_load=False; mode='retrieval' never loads the LLM or translators.
+
+        With mmap=True the index is memory-mapped read-only and SQLite is opened with a read-only
+        URI, so several worker processes on one host share a single page-cached copy of the vectors.
+        """
         import os
         
         if not os.path.exists(faiss_path):
@@ -169,21 +1364,62 @@ class RAG:
             raise FileNotFoundError(f"SQLite database not found: {sqlite_path}")
         
         # Load FAISS index
-        faiss_index = faiss.read_index(faiss_path)
+        start = time.perf_counter()
+        if mmap:
+            try:
+                faiss_index = faiss.read_index(faiss_path, FAISS_MMAP_FLAGS)
+            except RuntimeError as e:
+                # e.g. IVF inverted lists, which FAISS can only map when written in its on-disk format
+                print(f"⚠ WARNING: could not memory-map {faiss_path}, reading it into memory ({str(e).splitlines()[0]})")
+                faiss_index = faiss.read_index(faiss_path)
+        else:
+            faiss_index = faiss.read_index(faiss_path)
         dimension = faiss_index.d
-        print(f"✓ Loaded FAISS index: {faiss_index.ntotal} vectors")
+        index_config = load_index_config(faiss_path)
+        set_search_params(faiss_index, **index_config.get('search_params', {}))
+        set_search_params(faiss_index, nprobe=nprobe, efSearch=efSearch)
+        print(f"✓ Loaded FAISS index: {faiss_index.ntotal} vectors "
+              f"({index_config['index_factory']}, {get_search_params(faiss_index)})")
+        index_load_time = time.perf_counter() - start
         
         # Create instance without calling __init__
         instance = cls.__new__(cls)
-        
-        # Set up basic attributes
-        instance.dimension = dimension
-        instance.embedding_model = SentenceTransformer(embedding_model)
+        instance._configure(dimension=dimension, embedding_model=embedding_model, model_name=model_name,
+                            enable_translation=enable_translation, mode=mode,
+                            query_cache_size=query_cache_size, query_cache_path=query_cache_path,
+                            answer_cache_size=answer_cache_size, answer_cache_threshold=answer_cache_threshold,
+                            answer_cache_ttl=answer_cache_ttl,
+                            translation_cache_path=translation_cache_path, use_prefix_cache=use_prefix_cache,
+                            context_token_budget=context_token_budget, context_max_distance=context_max_distance,
+                            context_dedup_threshold=context_dedup_threshold,
+                            corpus_language=corpus_language or index_config.get('corpus_language', 'zh'),
+                            search_mode=search_mode, lexical_fast_path=lexical_fast_path,
+                            hybrid_candidates=hybrid_candidates,
+                            rerank_factor=(index_config.get('rerank_factor') if rerank_factor is None
+                                           else rerank_factor) or None,
+                            embedding_backend=embedding_backend, embedding_min_cosine=embedding_min_cosine,
+                            llm_dtype=llm_dtype, llm_quantization=llm_quantization, torch_threads=torch_threads,
+                            translation_num_beams=translation_num_beams,
+                            translation_length_ratio=translation_length_ratio,
+                            translation_max_input_tokens=translation_max_input_tokens,
+                            translation_quantization=translation_quantization)
         instance.faiss_index = faiss_index
+        instance.index_factory = index_config['index_factory']
+        instance.read_only = mmap
         
         # Load SQLite
-        instance.conn = sqlite3.connect(sqlite_path)
+        start = time.perf_counter()
+        if mmap:
+            instance.conn = sqlite3.connect(f"{Path(sqlite_path).resolve().as_uri()}?mode=ro", uri=True,
+                                            check_same_thread=False)
+        else:
+            instance.conn = sqlite3.connect(sqlite_path, check_same_thread=False)
         instance.cursor = instance.conn.cursor()
+        if not mmap:
+            instance._create_tables()
+        instance.has_fts = lexical.has_fts_table(instance.conn)
+        if search_mode != 'vector' and not instance.has_fts:
+            print("⚠ WARNING: no full-text index in this database (open it writable once to build it), using vector search")
         
         instance.cursor.execute("SELECT COUNT(*) FROM chunks")
         sqlite_count = instance.cursor.fetchone()[0]
@@ -191,29 +1427,24 @@ class RAG:
         
         if faiss_index.ntotal != sqlite_count:
             print("⚠ WARNING: FAISS and SQLite counts don't match!")
+
+        # Older saves assumed FAISS position p == SQLite row p + 1; key them by chunk id instead
+        instance.cursor.execute("SELECT id FROM chunks ORDER BY id")
+        chunk_ids = [row[0] for row in instance.cursor.fetchall()]
+        migrate_start = time.perf_counter()
+        if mmap and not has_id_map(faiss_index):
+            print("⚠ WARNING: legacy index is migrated in memory, re-save it with save_databases to share it via mmap")
+        instance.faiss_index = ensure_id_map(faiss_index, chunk_ids, instance.index_factory)
+        migrate_time = time.perf_counter() - migrate_start
+
+        instance.chunk_store = load_chunk_store(instance.cursor) if preload_chunks else None
+        if preload_chunks:
+            print(f"✓ Preloaded {len(instance.chunk_store)} chunks into memory")
+        instance.load_times['faiss_index'] = index_load_time + migrate_time
+        instance.load_times['sqlite'] = time.perf_counter() - start - migrate_time
+
+        if not lazy_load:
+            instance.load_models()
         
-        # Load LLM
-        instance.system_prompt = "You are a medical assistant. Give answers to the questions using your knowledge in combination with retrieved information"
-        instance.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
-        instance.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        instance.context = []
-        
-        # Load translation models if enabled
-        instance.enable_translation = enable_translation
-        if enable_translation:
-            print("Loading translation models...")
-            
-            instance.en_zh_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-en-zh")
-            instance.en_zh_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-en-zh")
-            print("✓ Loaded EN→ZH translator")
-            
-            instance.zh_en_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-zh-en")
-            instance.zh_en_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-zh-en")
-            print("✓ Loaded ZH→EN translator")
-        
-        print(f"✓ RAG system ready!")
-        return instance
\ No newline at end of file
+        print(f"✓ RAG system ready! (mode={mode}, models {'lazy' if lazy_load else 'loaded'})")
+        return instance
@@ -0,0 +1,244 @@
+"""
+Offline batch driver: streams questions from a JSONL file through retrieval and
+generation and appends one result per line to an output JSONL file.
+
+Progress is checkpointed after every batch, so an interrupted run resumes where
+it stopped instead of starting over:
+
+    python batch_runner.py questions.jsonl answers.jsonl --batch-size 16 --workers 2
+
+Each input line is a JSON object with the question in --query-field (default
+'query'), an optional id in --id-field (default 'request_id', else the line
+number) and an optional 'source_language' ('en' or 'zh'). Blank lines are skipped
+and malformed ones are written as error rows; a batch whose generation fails
+stops the run without being checkpointed, so the next run retries it.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+
+SOURCE_LANGUAGES = ('en', 'zh')
+
+# RAG instance of the current worker process (set by _init_worker)
+_rag = None
+
+
+def checkpoint_path(output_path):
+    return f"{output_path}.checkpoint.json"
+
+
+def load_checkpoint(output_path, input_path):
+    """Returns the saved progress for this output file, or a fresh one"""
+    path = checkpoint_path(output_path)
+    if not os.path.exists(path):
+        return {'input': os.path.abspath(input_path), 'lines_done': 0, 'output_bytes': 0, 'results': 0, 'errors': 0}
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['input'] != os.path.abspath(input_path):
+        raise ValueError(f"{path} belongs to {checkpoint['input']}, not {input_path}")
+    return checkpoint
+
+
+def save_checkpoint(output_path, checkpoint):
+    """Atomically replaces the checkpoint file"""
+    path = checkpoint_path(output_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_requests(input_path, skip_lines=0):
+    """Lazily yields (line_number, raw_line) pairs, skipping lines already processed"""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(islice(f, skip_lines, None), start=skip_lines):
+            yield line_number, line
+
+
+def _init_worker(rag_kwargs):
+    global _rag
+    from Rag_model import RAG
+    _rag = RAG.load_from_saved(**rag_kwargs)
+
+
+def _process_batch(batch, id_field, query_field, source_language, generate_batch_size):
+    """
+    Parses and answers one batch of raw lines; returns one result dict per non-blank line.
+    Generation errors are raised rather than recorded, so the batch is not checkpointed as done.
+    """
+    results = [None] * len(batch)
+    parsed = []
+    for i, (line_number, line) in enumerate(batch):
+        if not line.strip():
+            continue
+        # Anything generation would reject is caught here, so it becomes an error row
+        # instead of failing the batch on every resume
+        try:
+            record = json.loads(line)
+            query = record[query_field]
+            language = record.get('source_language', source_language)
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError(f"{query_field!r} must be a non-empty string, got {query!r}")
+            if language not in SOURCE_LANGUAGES:
+                raise ValueError(f"source_language must be one of {SOURCE_LANGUAGES}, got {language!r}")
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError, ValueError) as e:
+            results[i] = {'line': line_number, 'error': f"Invalid request: {e}"}
+            continue
+        parsed.append((i, line_number, record.get(id_field, line_number), query, language))
+
+    for language in dict.fromkeys(p[4] for p in parsed):
+        group = [p for p in parsed if p[4] == language]
+        answers = _rag.llm_generate_batch([p[3] for p in group], source_language=language,
+                                          batch_size=generate_batch_size)
+        for (i, line_number, request_id, query, _), answer, contexts in zip(group, answers, _rag.contexts):
+            results[i] = {'line': line_number, 'id': request_id, 'query': query,
+                          'source_language': language, 'answer': answer, 'contexts': contexts}
+    return [result for result in results if result is not None]
+
+
+def run(input_path, output_path, rag_kwargs, batch_size=16, workers=1, id_field='request_id',
+        query_field='query', source_language='en', generate_batch_size=8):
+    """
+    Processes input_path in batches and appends results to output_path, resuming from the checkpoint
+
+    Args:
+        input_path: JSONL file of requests
+        output_path: JSONL file results are appended to
+        rag_kwargs: Keyword arguments for RAG.load_from_saved in each worker
+        batch_size: Requests per batch handed to a worker
+        workers: Worker processes, each with its own RAG (0 runs in this process)
+        id_field: Request field copied to the result as 'id'
+        query_field: Request field holding the question
+        source_language: Default language of the questions
+        generate_batch_size: Prompts per LLM generate call inside a batch
+
+    Returns:
+        dict: Final checkpoint (lines done, results and errors written)
+    """
+    checkpoint = load_checkpoint(output_path, input_path)
+    if checkpoint['lines_done']:
+        print(f"Resuming after {checkpoint['lines_done']} lines ({checkpoint['results']} results)")
+
+    # Drop anything written after the last checkpoint (a batch that crashed half-way)
+    with open(output_path, 'a+b') as f:
+        f.truncate(checkpoint['output_bytes'])
+
+    lines = read_requests(input_path, checkpoint['lines_done'])
+    batches = iter(lambda: list(islice(lines, batch_size)), [])
+    task_args = (id_field, query_field, source_language, generate_batch_size)
+
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rag_kwargs,))
+        submit = lambda batch: executor.submit(_process_batch, batch, *task_args)
+    else:
+        _init_worker(rag_kwargs)
+        executor = None
+        submit = lambda batch: _ImmediateResult(lambda: _process_batch(batch, *task_args))
+
+    start = time.perf_counter()
+    processed = 0
+    pending = deque()
+    try:
+        with open(output_path, 'a', encoding='utf-8') as out:
+            while True:
+                # Keep every worker busy, with a bounded number of batches in flight
+                while len(pending) < max(workers, 1) * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    pending.append((batch, submit(batch)))
+                if not pending:
+                    break
+
+                # Results are written in input order, so the checkpoint is always a clean prefix
+                batch, future = pending.popleft()
+                try:
+                    results = future.result()
+                except Exception:
+                    print(f"⚠ Batch starting at line {batch[0][0]} failed; rerun to retry it "
+                          f"(progress is checkpointed up to line {checkpoint['lines_done']})")
+                    raise
+                for result in results:
+                    out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+
+                processed += len(batch)
+                checkpoint['lines_done'] = batch[-1][0] + 1
+                checkpoint['output_bytes'] = out.tell()
+                checkpoint['results'] += sum('error' not in r for r in results)
+                checkpoint['errors'] += sum('error' in r for r in results)
+                save_checkpoint(output_path, checkpoint)
+
+                elapsed = time.perf_counter() - start
+                print(f"  {checkpoint['lines_done']} lines done "
+                      f"({processed / elapsed:.2f} requests/sec this run, {checkpoint['errors']} errors)")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    print(f"✓ Finished {input_path}: {checkpoint['results']} results, {checkpoint['errors']} errors → {output_path}")
+    return checkpoint
+
+
+class _ImmediateResult:
+    """Future-like wrapper for batches processed in the main process, when their result is requested"""
+
+    def __init__(self, compute):
+        self.compute = compute
+
+    def result(self):
+        return self.compute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file of requests')
+    parser.add_argument('output', help='JSONL file results are appended to')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes (0 = run in this process)')
+    parser.add_argument('--generate-batch-size', type=int, default=8)
+    parser.add_argument('--id-field', default='request_id')
+    parser.add_argument('--query-field', default='query')
+    parser.add_argument('--source-language', default='en', choices=SOURCE_LANGUAGES)
+    parser.add_argument('--faiss-path', default='medical_rag.index')
+    parser.add_argument('--sqlite-path', default='medical_chunks.db')
+    parser.add_argument('--embedding-model', default='moka-ai/m3e-base')
+    parser.add_argument('--model-name', default="Qwen/Qwen2-1.5B-Instruct")
+    parser.add_argument('--embedding-backend', default='torch', choices=['torch', 'int8', 'onnx'])
+    parser.add_argument('--llm-dtype', default='auto', choices=['auto', 'float16', 'bfloat16', 'float32'])
+    parser.add_argument('--llm-quantization', default=None, choices=['int8'])
+    parser.add_argument('--threads', type=int, default=None, help='torch threads per worker')
+    parser.add_argument('--translation-beams', type=int, default=None, help='1 = greedy (default: model setting)')
+    parser.add_argument('--translation-quantization', default=None, choices=['int8'])
+    args = parser.parse_args()
+
+    rag_kwargs = {
+        'faiss_path': args.faiss_path,
+        'sqlite_path': args.sqlite_path,
+        'embedding_model': args.embedding_model,
+        'model_name': args.model_name,
+        'embedding_backend': args.embedding_backend,
+        'llm_dtype': args.llm_dtype,
+        'llm_quantization': args.llm_quantization,
+        'torch_threads': args.threads,
+        'translation_num_beams': args.translation_beams,
+        'translation_quantization': args.translation_quantization,
+        # Workers only read the index, so they share one memory-mapped copy
+        'mmap': True,
+    }
+    run(args.input, args.output, rag_kwargs, batch_size=args.batch_size, workers=args.workers,
+        id_field=args.id_field, query_field=args.query_field, source_language=args.source_language,
+        generate_batch_size=args.generate_batch_size)
+
+
+if __name__ == "__main__":
+    main()
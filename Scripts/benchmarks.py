@@ -0,0 +1,632 @@
+"""
+Performance benchmarks for the Medical RAG system.
+
+Run from the Scripts folder, e.g.:
+    python benchmarks.py loading --workers 4
+    python benchmarks.py generation --batch-size 8
+    python benchmarks.py prefix-cache
+    python benchmarks.py chunking --json-folder Json_files --max-tokens 256
+    python benchmarks.py compression --rerank-factor 4
+    python benchmarks.py embedding --backends torch int8 onnx
+    python benchmarks.py llm-precision --precisions float32 bfloat16 int8 --threads 8
+    python benchmarks.py translation
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import time
+
+import numpy as np
+
+
+# Fixed English questions shared by the generation benchmarks
+SAMPLE_QUESTIONS = [
+    "What are the symptoms of anxiety disorder?",
+    "What causes diabetes?",
+    "How is hypertension treated?",
+    "What are the risk factors for stroke?",
+    "What are the complications of COPD?",
+    "How is asthma diagnosed?",
+    "What is the treatment for hepatitis B?",
+    "How can osteoporosis be prevented?",
+]
+
+
+# Fixed English / Chinese medical sentence pairs with reference translations
+TRANSLATION_PAIRS = [
+    ("What are the symptoms of anxiety disorder?", "焦虑症有哪些症状？"),
+    ("Diabetes is caused by insufficient insulin secretion or insulin resistance.",
+     "糖尿病是由胰岛素分泌不足或胰岛素抵抗引起的。"),
+    ("Patients with hypertension should reduce their salt intake.", "高血压患者应减少盐的摄入。"),
+    ("Smoking is a major risk factor for stroke.", "吸烟是中风的主要危险因素。"),
+    ("Asthma is diagnosed with lung function tests.", "哮喘通过肺功能检查来诊断。"),
+    ("Hepatitis B can be transmitted through blood.", "乙型肝炎可以通过血液传播。"),
+    ("Calcium and vitamin D help prevent osteoporosis.", "钙和维生素D有助于预防骨质疏松症。"),
+    ("Take the medicine twice a day after meals.", "每天饭后服药两次。"),
+]
+
+
+def memory_usage():
+    """
+    Memory of the current process in MB. On Linux this splits RSS into anonymous
+    (private heap) and file-backed pages, and reports PSS, which divides pages
+    shared between processes (e.g. a memory-mapped index) among them.
+    """
+    usage = {'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    fields = {'VmRSS': 'rss_mb', 'RssAnon': 'rss_anon_mb', 'RssFile': 'rss_file_mb'}
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                key = line.split(':')[0]
+                if key in fields:
+                    usage[fields[key]] = int(line.split()[1]) / 1024
+    if os.path.exists('/proc/self/smaps_rollup'):
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    usage['pss_mb'] = int(line.split()[1]) / 1024
+    return usage
+
+
+def _loading_worker(faiss_path, sqlite_path, mmap, barrier, results):
+    from Rag_model import RAG
+
+    start = time.perf_counter()
+    rag = RAG.load_from_saved(faiss_path=faiss_path, sqlite_path=sqlite_path,
+                              mode='retrieval', translation_cache_path=None, mmap=mmap)
+    cold_start = time.perf_counter() - start
+
+    # One full search touches every stored vector, like a serving worker would
+    query = np.random.default_rng(os.getpid()).random((1, rag.faiss_index.d), dtype='float32')
+    start = time.perf_counter()
+    rag.faiss_index.search(query, 3)
+    first_search = time.perf_counter() - start
+
+    # Measure while every worker is alive, so shared pages are actually shared
+    barrier.wait()
+    results.put({'mmap': mmap, 'cold_start_s': cold_start, 'first_search_ms': first_search * 1000,
+                 **memory_usage()})
+    barrier.wait()
+    rag.close()
+
+
+def benchmark_worker_loading(faiss_path='medical_rag.index', sqlite_path='medical_chunks.db', workers=4):
+    """
+    Starts `workers` processes that each load the saved index, once with a regular
+    heap copy and once memory-mapped, and reports per-worker RSS/PSS and cold-start time
+
+    Returns:
+        dict: {'heap': [...], 'mmap': [...]} with one measurement dict per worker
+    """
+    ctx = mp.get_context('spawn')
+    report = {}
+
+    for mmap in (False, True):
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=_loading_worker, args=(faiss_path, sqlite_path, mmap, barrier, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        measurements = [results.get() for _ in range(workers)]
+        for process in processes:
+            process.join()
+        report['mmap' if mmap else 'heap'] = measurements
+
+    print("=" * 60)
+    print(f"INDEX LOADING: {workers} WORKERS")
+    print("=" * 60)
+    print(f"{'Mode':<8}{'Cold start (s)':>16}{'RSS (MB)':>12}{'Anon (MB)':>12}{'PSS (MB)':>12}")
+    for mode, measurements in report.items():
+        def mean(key):
+            values = [m[key] for m in measurements if key in m]
+            return sum(values) / len(values) if values else float('nan')
+        print(f"{mode:<8}{mean('cold_start_s'):>16.3f}{mean('rss_mb'):>12.1f}"
+              f"{mean('rss_anon_mb'):>12.1f}{mean('pss_mb'):>12.1f}")
+    return report
+
+
+def benchmark_generation_batching(rag, queries=SAMPLE_QUESTIONS, source_language='en', batch_size=8):
+    """
+    Compares llm_generate called once per query with one llm_generate_batch call
+    over the same queries. The answer cache is cleared before each run.
+
+    Returns:
+        dict: elapsed time and queries/sec for the 'single' and 'batch' paths
+    """
+    rag.warmup()
+
+    rag.answer_cache.invalidate()
+    start = time.perf_counter()
+    for query in queries:
+        rag.llm_generate(query, source_language=source_language)
+    single = time.perf_counter() - start
+
+    rag.answer_cache.invalidate()
+    start = time.perf_counter()
+    rag.llm_generate_batch(queries, source_language=source_language, batch_size=batch_size)
+    batch = time.perf_counter() - start
+
+    report = {
+        'single': {'elapsed_s': single, 'queries_per_sec': len(queries) / single},
+        'batch': {'elapsed_s': batch, 'queries_per_sec': len(queries) / batch, **rag.last_batch_stats},
+    }
+    print("=" * 60)
+    print(f"GENERATION THROUGHPUT: {len(queries)} QUERIES, BATCH SIZE {batch_size}")
+    print("=" * 60)
+    print(f"{'Path':<10}{'Elapsed (s)':>14}{'Queries/sec':>14}")
+    for path, result in report.items():
+        print(f"{path:<10}{result['elapsed_s']:>14.1f}{result['queries_per_sec']:>14.2f}")
+    print(f"Speedup: {single / batch:.2f}x, padding waste {rag.last_batch_stats['padding_waste']:.0%}")
+    return report
+
+
+def benchmark_prefix_cache(rag, queries=SAMPLE_QUESTIONS, source_language='en', repeats=3):
+    """
+    Measures the prefill forward pass per request with and without the cached KV of
+    the shared system-prompt prefix. Only the prompt pass is timed, not decoding.
+
+    Returns:
+        dict: mean prefill ms per request for the 'full' and 'cached' paths, plus prefix/prompt token counts
+    """
+    import copy
+    import torch
+
+    rag.warmup()
+    prefix_ids, past_key_values = rag._get_prefix_cache()
+    n_prefix = prefix_ids.shape[1]
+
+    prompts = []
+    for query in queries:
+        corpus_query = rag._to_corpus_query(query, source_language)
+        prompts.append(rag._build_prompt(corpus_query, rag._retrieve_context(corpus_query)))
+
+    full, cached, prompt_tokens = [], [], []
+    for text in prompts:
+        inputs = rag.tokenizer(text, return_tensors="pt").to(rag.model.device)
+        input_ids = inputs['input_ids']
+        n_tokens = input_ids.shape[1]
+        prompt_tokens.append(n_tokens)
+        for _ in range(repeats):
+            with torch.no_grad():
+                start = time.perf_counter()
+                rag.model(**inputs, use_cache=True)
+                full.append(time.perf_counter() - start)
+
+                # The copy is part of the per-request cost, so it is timed too
+                start = time.perf_counter()
+                rag.model(input_ids=input_ids[:, n_prefix:], attention_mask=inputs['attention_mask'],
+                          past_key_values=copy.deepcopy(past_key_values),
+                          cache_position=torch.arange(n_prefix, n_tokens, device=input_ids.device),
+                          use_cache=True)
+                cached.append(time.perf_counter() - start)
+
+    report = {
+        'full': {'prefill_ms': 1000 * sum(full) / len(full)},
+        'cached': {'prefill_ms': 1000 * sum(cached) / len(cached)},
+        'prefix_tokens': n_prefix,
+        'mean_prompt_tokens': sum(prompt_tokens) / len(prompt_tokens),
+        'prefix_build_s': rag.prefix_cache_stats.get('build_s', 0.0),
+    }
+    print("=" * 60)
+    print(f"PREFILL: {len(prompts)} PROMPTS x {repeats}, {n_prefix}-TOKEN SHARED PREFIX "
+          f"(mean prompt {report['mean_prompt_tokens']:.0f} tokens)")
+    print("=" * 60)
+    print(f"{'Path':<10}{'Prefill (ms)':>14}")
+    for path in ('full', 'cached'):
+        print(f"{path:<10}{report[path]['prefill_ms']:>14.1f}")
+    print(f"Saved {report['full']['prefill_ms'] - report['cached']['prefill_ms']:.1f} ms per request "
+          f"({report['full']['prefill_ms'] / report['cached']['prefill_ms']:.2f}x)")
+    return report
+
+
+def benchmark_chunking(json_folder='Json_files', embedding_model='moka-ai/m3e-base', strategies=None,
+                       max_tokens=256, overlap=32, k=3, n_queries=200, seed=0):
+    """
+    Builds an in-memory index per chunking strategy and reports chunk count, index size,
+    search latency and recall@k.
+
+    Queries are sentences sampled from the middle of sections; a query counts as recalled
+    when one of its top-k chunks comes from the same document and section.
+
+    Returns:
+        dict: strategy -> {'chunks', 'mean_chunk_tokens', 'index_mb', 'search_ms', 'recall_at_k'}
+    """
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    from chunking import CHUNK_STRATEGIES, create_all_chunks, token_spans
+    from index_factory import create_index
+    from rag_functions import split_sentences
+
+    strategies = strategies or CHUNK_STRATEGIES
+    model = SentenceTransformer(embedding_model)
+
+    # Evaluation queries: one inner sentence per sampled section, shared by every strategy
+    sections = create_all_chunks(json_folder, strategy='section')
+    rng = np.random.default_rng(seed)
+    queries, targets = [], []
+    for i in rng.permutation(len(sections)):
+        body = sections[i]['text'].split('\n\n', 1)[-1]
+        sentences = [s for line in body.split('\n') for s in split_sentences(line) if len(s) >= 8]
+        if sentences:
+            queries.append(sentences[len(sentences) // 2])
+            targets.append((sections[i]['document'], sections[i]['section']))
+        if len(queries) == n_queries:
+            break
+    query_vectors = np.asarray(model.encode(queries, batch_size=64), dtype='float32')
+
+    report = {}
+    for strategy in strategies:
+        chunks = create_all_chunks(json_folder, strategy=strategy, max_tokens=max_tokens, overlap=overlap)
+        vectors = np.asarray(model.encode([c['text'] for c in chunks], batch_size=64), dtype='float32')
+        index = create_index(vectors.shape[1])
+        index.add_with_ids(vectors, np.arange(len(chunks), dtype='int64'))
+
+        start = time.perf_counter()
+        _, labels = index.search(query_vectors, k)
+        search_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+        recalled = sum(any(label >= 0 and (chunks[label]['document'], chunks[label]['section']) == target
+                           for label in row)
+                       for row, target in zip(labels, targets))
+        report[strategy] = {
+            'chunks': len(chunks),
+            'mean_chunk_tokens': sum(len(token_spans(c['text'])) for c in chunks) / len(chunks),
+            'index_mb': faiss.serialize_index(index).nbytes / 1024 ** 2,
+            'search_ms': search_ms,
+            'recall_at_k': recalled / len(queries),
+        }
+
+    print("=" * 60)
+    print(f"CHUNKING: max_tokens={max_tokens}, overlap={overlap}, {len(queries)} QUERIES, k={k}")
+    print("=" * 60)
+    print(f"{'Strategy':<10}{'Chunks':>8}{'Tokens':>8}{'Index (MB)':>12}{'Search (ms)':>13}{f'Recall@{k}':>10}")
+    for strategy, result in report.items():
+        print(f"{strategy:<10}{result['chunks']:>8}{result['mean_chunk_tokens']:>8.0f}{result['index_mb']:>12.2f}"
+              f"{result['search_ms']:>13.3f}{result['recall_at_k']:>10.1%}")
+    return report
+
+
+def benchmark_compression(rag, compressions=None, k=3, rerank_factor=4, n_queries=200, repeats=3, seed=0):
+    """
+    Rebuilds the corpus in a flat index and in each compressed variant (SQ8, SQ4, PQ),
+    with and without exact re-ranking of k * rerank_factor candidates against the
+    original embeddings stored in SQLite, and reports index size, search latency and
+    recall@k against the flat index. Queries are a sample of the stored chunk vectors.
+
+    Returns:
+        dict: variant -> {'factory', 'index_mb', 'search_ms', 'recall_at_k'}
+    """
+    from index_factory import (COMPRESSIONS, compressed_factory, create_index, index_size_bytes, recall_at_k,
+                               train_index)
+    from rag_functions import rerank_exact
+
+    ids, vectors = rag.stored_embeddings()
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    cursor = rag.conn.cursor()
+
+    variants = [('flat', 'Flat', None)]
+    for compression in compressions or COMPRESSIONS:
+        factory = compressed_factory(compression, vectors.shape[1], len(vectors))
+        variants += [(compression, factory, None), (f"{compression}+rerank", factory, rerank_factor)]
+
+    report = {}
+    built = {}
+    for name, factory, factor in variants:
+        if factory not in built:
+            index = create_index(vectors.shape[1], factory)
+            train_index(index, vectors)
+            index.add_with_ids(vectors, ids)
+            built[factory] = index
+        index = built[factory]
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            if factor:
+                distances, labels = index.search(queries, k * factor)
+                _, labels = rerank_exact(queries, distances, labels, cursor, k)
+            else:
+                _, labels = index.search(queries, k)
+        search_ms = 1000 * (time.perf_counter() - start) / (repeats * len(queries))
+
+        if name == 'flat':
+            ground_truth = labels
+        report[name] = {
+            'factory': factory,
+            'index_mb': index_size_bytes(index) / 1024 ** 2,
+            'search_ms': search_ms,
+            'recall_at_k': recall_at_k(labels, ground_truth, k),
+        }
+
+    flat_mb = report['flat']['index_mb']
+    print("=" * 60)
+    print(f"COMPRESSION: {len(vectors)} VECTORS, {len(queries)} QUERIES, k={k}, RE-RANK {k * rerank_factor} CANDIDATES")
+    print("=" * 60)
+    print(f"{'Variant':<14}{'Factory':<10}{'Index (MB)':>12}{'Ratio':>8}{'Search (ms)':>13}{f'Recall@{k}':>10}")
+    for name, result in report.items():
+        print(f"{name:<14}{result['factory']:<10}{result['index_mb']:>12.2f}{flat_mb / result['index_mb']:>7.1f}x"
+              f"{result['search_ms']:>13.3f}{result['recall_at_k']:>10.1%}")
+    print("Re-ranking reads the original vectors from SQLite, so it adds no index memory")
+    return report
+
+
+def benchmark_embedding_backends(texts, embedding_model='moka-ai/m3e-base', backends=None, batch_size=64,
+                                 min_cosine=0.99):
+    """
+    Encodes the same texts with each embedding backend and reports sentences/sec and
+    cosine similarity of its embeddings to the fp32 ones
+
+    Args:
+        texts: Texts to encode (e.g. stored chunks)
+        embedding_model: SentenceTransformer model name
+        backends: Subset of embedding_backends.EMBEDDING_BACKENDS (default: all)
+        batch_size: Encoding batch size
+        min_cosine: Agreement threshold, as used by RAG(embedding_min_cosine=...)
+
+    Returns:
+        dict: backend -> {'sentences_per_sec', 'min_cosine', 'mean_cosine', 'passed'}
+    """
+    from embedding_backends import EMBEDDING_BACKENDS, cosine_agreement, load_embedding_model, sentences_per_second
+
+    reference = load_embedding_model(embedding_model)
+    reference_vectors = reference.encode(texts, batch_size=batch_size)
+
+    report = {}
+    for backend in backends or EMBEDDING_BACKENDS:
+        model = reference if backend == 'torch' else load_embedding_model(embedding_model, backend)
+        similarities = cosine_agreement(reference_vectors, model.encode(texts, batch_size=batch_size))
+        report[backend] = {
+            'sentences_per_sec': sentences_per_second(model, texts, batch_size),
+            'min_cosine': float(similarities.min()),
+            'mean_cosine': float(similarities.mean()),
+            'passed': bool(similarities.min() >= min_cosine),
+        }
+
+    print("=" * 60)
+    print(f"EMBEDDING BACKENDS: {embedding_model}, {len(texts)} TEXTS, BATCH SIZE {batch_size}")
+    print("=" * 60)
+    print(f"{'Backend':<10}{'Sentences/sec':>15}{'Speedup':>9}{'Min cos':>10}{'Mean cos':>10}  Check")
+    base = report.get('torch', next(iter(report.values())))['sentences_per_sec']
+    for backend, result in report.items():
+        print(f"{backend:<10}{result['sentences_per_sec']:>15.1f}{result['sentences_per_sec'] / base:>8.2f}x"
+              f"{result['min_cosine']:>10.4f}{result['mean_cosine']:>10.4f}  "
+              f"{'✓' if result['passed'] else f'⚠ below {min_cosine}'}")
+    return report
+
+
+def benchmark_llm_precision(load_rag, precisions=('float32', 'bfloat16', 'int8'), queries=SAMPLE_QUESTIONS,
+                            max_new_tokens=64):
+    """
+    Loads the LLM once per precision and measures greedy decoding speed on the same
+    prompts (questions only, no retrieval, so only the LLM is timed)
+
+    Args:
+        load_rag: Function returning a RAG for keyword arguments llm_dtype / llm_quantization
+        precisions: dtype names from torch_settings.DTYPES, or 'int8' for dynamic quantization
+        queries: Questions used as prompts
+        max_new_tokens: Tokens generated per prompt
+
+    Returns:
+        dict: precision -> {'load_s', 'tokens_per_sec', 'generated_tokens', 'device'}
+    """
+    import torch
+
+    report = {}
+    for precision in precisions:
+        if precision == 'int8':
+            rag = load_rag(llm_quantization='int8')
+        else:
+            rag = load_rag(llm_dtype=precision)
+        tokenizer, model = rag.tokenizer, rag.model
+
+        generated = 0
+        elapsed = 0.0
+        for query in queries:
+            messages = [{"role": "system", "content": rag.system_prompt}, {"role": "user", "content": query}]
+            text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            inputs = tokenizer(text, return_tensors="pt").to(model.device)
+            start = time.perf_counter()
+            with torch.no_grad():
+                outputs = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                         pad_token_id=tokenizer.eos_token_id)
+            elapsed += time.perf_counter() - start
+            generated += outputs.shape[1] - inputs['input_ids'].shape[1]
+
+        report[precision] = {
+            'load_s': rag.load_times['llm'],
+            'tokens_per_sec': generated / elapsed,
+            'generated_tokens': generated,
+            'device': str(model.device),
+        }
+        rag.close()
+
+    print("=" * 60)
+    print(f"LLM PRECISION: {len(queries)} PROMPTS, {max_new_tokens} NEW TOKENS, {torch.get_num_threads()} THREADS")
+    print("=" * 60)
+    print(f"{'Precision':<12}{'Device':<8}{'Load (s)':>10}{'Tokens/sec':>12}")
+    for precision, result in report.items():
+        print(f"{precision:<12}{result['device']:<8}{result['load_s']:>10.1f}{result['tokens_per_sec']:>12.2f}")
+    return report
+
+
+def _char_ngrams(text, n):
+    text = text.replace(' ', '')
+    counts = {}
+    for i in range(len(text) - n + 1):
+        counts[text[i:i + n]] = counts.get(text[i:i + n], 0) + 1
+    return counts
+
+
+def chrf(hypothesis, reference, max_n=6, beta=2):
+    """Character n-gram F-score (chrF) of a translation against a reference, 0-100"""
+    precisions, recalls = [], []
+    for n in range(1, max_n + 1):
+        hyp, ref = _char_ngrams(hypothesis, n), _char_ngrams(reference, n)
+        if not hyp or not ref:
+            continue
+        overlap = sum(min(count, ref.get(gram, 0)) for gram, count in hyp.items())
+        precisions.append(overlap / sum(hyp.values()))
+        recalls.append(overlap / sum(ref.values()))
+    if not precisions:
+        return 0.0
+    precision, recall = sum(precisions) / len(precisions), sum(recalls) / len(recalls)
+    if precision + recall == 0:
+        return 0.0
+    return 100 * (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+def benchmark_translation(settings=None, pairs=TRANSLATION_PAIRS, repeats=3):
+    """
+    Translates fixed medical sentences in both directions with several engine settings
+    and reports mean latency per sentence and chrF against the reference translations.
+    Sentences are translated one at a time, as on the request path, without the cache.
+
+    Args:
+        settings: name -> RAG translation kwargs (translation_num_beams, translation_length_ratio,
+            translation_quantization); defaults to the model's beam search, small beams, greedy and int8
+        pairs: (English, Chinese) sentence pairs
+        repeats: Timed passes over the sentences
+
+    Returns:
+        dict: setting -> direction -> {'latency_ms', 'chrf'}
+    """
+    from Rag_model import TRANSLATION_MODELS
+    from translation import DIRECTIONS
+
+    settings = settings or {
+        'default': {'translation_num_beams': None, 'translation_length_ratio': None},
+        'beam2': {'translation_num_beams': 2},
+        'greedy': {'translation_num_beams': 1},
+        'greedy-int8': {'translation_num_beams': 1, 'translation_quantization': 'int8'},
+    }
+
+    report = {}
+    for name, kwargs in settings.items():
+        rag = _translation_rag(**kwargs)
+        report[name] = {}
+        for direction in TRANSLATION_MODELS:
+            source, target = DIRECTIONS[direction]
+            sources = [pair[0] if source == 'en' else pair[1] for pair in pairs]
+            references = [pair[1] if target == 'zh' else pair[0] for pair in pairs]
+            rag.translate_batch(sources[:1], direction)  # load and warm up the model
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                translations = [rag.translate_batch([text], direction)[0] for text in sources]
+            latency_ms = 1000 * (time.perf_counter() - start) / (repeats * len(sources))
+            report[name][direction] = {
+                'latency_ms': latency_ms,
+                'chrf': sum(map(chrf, translations, references)) / len(references),
+            }
+        rag.close()
+
+    print("=" * 60)
+    print(f"TRANSLATION: {len(pairs)} SENTENCES PER DIRECTION x {repeats}")
+    print("=" * 60)
+    print(f"{'Setting':<14}{'Direction':<11}{'Latency (ms)':>14}{'chrF':>8}")
+    for name, directions in report.items():
+        for direction, result in directions.items():
+            print(f"{name:<14}{direction:<11}{result['latency_ms']:>14.1f}{result['chrf']:>8.1f}")
+    return report
+
+
+def _translation_rag(**kwargs):
+    """A RAG object only used for its translators: empty in-memory database, no translation cache"""
+    from Rag_model import RAG
+    return RAG(dimension=768, sqlite_path=':memory:', translation_cache_path=None, **kwargs)
+
+
+def _load_rag(args, **kwargs):
+    from Rag_model import RAG
+    return RAG.load_from_saved(faiss_path=args.faiss_path, sqlite_path=args.sqlite_path,
+                               embedding_model=args.embedding_model, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--faiss-path', default='medical_rag.index')
+    common.add_argument('--sqlite-path', default='medical_chunks.db')
+    common.add_argument('--embedding-model', default='moka-ai/m3e-base')
+
+    loading = subparsers.add_parser('loading', parents=[common],
+                                    help='Per-worker RSS and cold start, heap vs. mmap index')
+    loading.add_argument('--workers', type=int, default=4)
+
+    generation = subparsers.add_parser('generation', parents=[common],
+                                       help='Throughput of llm_generate vs. llm_generate_batch')
+    generation.add_argument('--batch-size', type=int, default=8)
+
+    prefix_cache = subparsers.add_parser('prefix-cache', parents=[common],
+                                         help='Prefill time per request with vs. without the system-prompt KV cache')
+    prefix_cache.add_argument('--repeats', type=int, default=3)
+
+    chunking = subparsers.add_parser('chunking', parents=[common],
+                                     help='Chunk count, index size, latency and recall per chunking strategy')
+    chunking.add_argument('--json-folder', default='Json_files')
+    chunking.add_argument('--strategies', nargs='+', default=None)
+    chunking.add_argument('--max-tokens', type=int, default=256)
+    chunking.add_argument('--overlap', type=int, default=32)
+    chunking.add_argument('--queries', type=int, default=200)
+
+    compression = subparsers.add_parser('compression', parents=[common],
+                                        help='Index size, latency and recall@k of SQ8/SQ4/PQ vs. the flat index')
+    compression.add_argument('--compressions', nargs='+', default=None)
+    compression.add_argument('--k', type=int, default=3)
+    compression.add_argument('--rerank-factor', type=int, default=4)
+    compression.add_argument('--queries', type=int, default=200)
+
+    embedding = subparsers.add_parser('embedding', parents=[common],
+                                      help='Sentences/sec and fp32 agreement of the embedding backends')
+    embedding.add_argument('--backends', nargs='+', default=None)
+    embedding.add_argument('--texts', type=int, default=512)
+    embedding.add_argument('--batch-size', type=int, default=64)
+    embedding.add_argument('--min-cosine', type=float, default=0.99)
+
+    llm_precision = subparsers.add_parser('llm-precision', parents=[common],
+                                          help='LLM tokens/sec per dtype / int8 quantization')
+    llm_precision.add_argument('--precisions', nargs='+', default=['float32', 'bfloat16', 'int8'])
+    llm_precision.add_argument('--threads', type=int, default=None)
+    llm_precision.add_argument('--max-new-tokens', type=int, default=64)
+
+    subparsers.add_parser('translation', help='Latency and chrF of greedy / beam / int8 Marian translation')
+
+    args = parser.parse_args()
+    if args.command == 'loading':
+        benchmark_worker_loading(args.faiss_path, args.sqlite_path, args.workers)
+    elif args.command == 'generation':
+        rag = _load_rag(args)
+        benchmark_generation_batching(rag, batch_size=args.batch_size)
+        rag.close()
+    elif args.command == 'prefix-cache':
+        rag = _load_rag(args)
+        benchmark_prefix_cache(rag, repeats=args.repeats)
+        rag.close()
+    elif args.command == 'chunking':
+        benchmark_chunking(args.json_folder, args.embedding_model, args.strategies,
+                           args.max_tokens, args.overlap, n_queries=args.queries)
+    elif args.command == 'compression':
+        rag = _load_rag(args, mode='retrieval', translation_cache_path=None)
+        benchmark_compression(rag, args.compressions, args.k, args.rerank_factor, args.queries)
+        rag.close()
+    elif args.command == 'embedding':
+        import sqlite3
+        conn = sqlite3.connect(args.sqlite_path)
+        texts = [row[0] for row in conn.execute("SELECT text FROM chunks ORDER BY id LIMIT ?", (args.texts,))]
+        conn.close()
+        benchmark_embedding_backends(texts, args.embedding_model, args.backends, args.batch_size, args.min_cosine)
+    elif args.command == 'translation':
+        benchmark_translation()
+    elif args.command == 'llm-precision':
+        benchmark_llm_precision(lambda **kwargs: _load_rag(args, enable_translation=False, torch_threads=args.threads,
+                                                           **kwargs),
+                                args.precisions, max_new_tokens=args.max_new_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import os
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+def normalize_query(text):
+    """
+    Canonical cache key for a query: NFKC-normalized (full-width → half-width),
+    lower-cased, with whitespace collapsed
+    """
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of query vectors keyed by normalized query text.
+    Entries are tied to the embedding model name, so a cache persisted for
+    one model is discarded when loaded for another.
+    """
+
+    def __init__(self, model_name, max_size=1024, path=None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text):
+        """Returns the cached vector for a query, or None"""
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, text, vector):
+        """Stores a query vector, evicting the least recently used entry when full"""
+        key = normalize_query(text)
+        with self._lock:
+            self._entries[key] = np.asarray(vector, dtype='float32').reshape(-1)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def encode(self, texts, embedding_model, batch_size=64):
+        """
+        Encodes queries through the cache: hits are served from memory and all
+        misses are encoded together in one batched call
+
+        Args:
+            texts: List of query strings
+            embedding_model: SentenceTransformer model used for misses
+            batch_size: Batch size passed to SentenceTransformer.encode
+
+        Returns:
+            np.ndarray: float32 matrix with one row per query
+        """
+        vectors = [self.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Identical misses in the same batch are only encoded once
+            unique = {}
+            for i in missing:
+                unique.setdefault(normalize_query(texts[i]), texts[i])
+            encoded = embedding_model.encode(list(unique.values()), batch_size=batch_size)
+            encoded = np.asarray(encoded, dtype='float32').reshape(len(unique), -1)
+            by_key = dict(zip(unique, encoded))
+            for key, vector in by_key.items():
+                self.put(unique[key], vector)
+            for i in missing:
+                vectors[i] = by_key[normalize_query(texts[i])]
+        return np.stack(vectors).astype('float32')
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def save(self, path=None):
+        """Persists the cache (with its model name) so it survives restarts"""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            data = {'model_name': self.model_name, 'entries': list(self._entries.items())}
+        with open(path, 'wb') as f:
+            pickle.dump(data, f)
+        print(f"✓ Saved {len(data['entries'])} cached query embeddings to {path}")
+
+    def load(self, path=None):
+        """Loads a persisted cache, ignoring it if it was built with another embedding model"""
+        path = path or self.path
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('model_name') != self.model_name:
+            print(f"⚠ Query cache at {path} was built with {data.get('model_name')}, ignoring it")
+            return
+        with self._lock:
+            self._entries = OrderedDict(data['entries'][-self.max_size:])
+        print(f"✓ Loaded {len(self._entries)} cached query embeddings from {path}")
+
+
+class SemanticCache:
+    """
+    Response cache keyed by query meaning rather than exact text: past query
+    embeddings live in a small inner-product FAISS index, and a new query whose
+    cosine similarity to a cached one reaches the threshold reuses its answer.
+    Entries expire after ttl seconds, the oldest are evicted beyond max_size,
+    and everything is dropped when the chunk index changes. max_size=0 disables it.
+    """
+
+    def __init__(self, dimension, threshold=0.95, max_size=1000, ttl=3600, search_k=4):
+        self.dimension = dimension
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.search_k = search_k
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._entries = OrderedDict()
+        self._index = faiss.index_factory(dimension, "IDMap,Flat", faiss.METRIC_INNER_PRODUCT)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        """False when max_size is 0; callers can then skip embedding the query for it"""
+        return self.max_size > 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype='float32').reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_ids):
+        if not entry_ids:
+            return
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.asarray(entry_ids, dtype='int64'))
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry['created'] > self.ttl
+
+    def lookup(self, query_vector, source_language='en'):
+        """
+        Returns the cached entry for a semantically equivalent past query, or None
+
+        Args:
+            query_vector: Embedding of the incoming query
+            source_language: Language the answer must be in
+
+        Returns:
+            dict or None: {'query', 'answer', 'context_ids', 'source_language', 'similarity', ...}
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            similarities, entry_ids = self._index.search(self._normalize(query_vector), self.search_k)
+            expired = []
+            for similarity, entry_id in zip(similarities[0], entry_ids[0]):
+                entry = self._entries.get(int(entry_id))
+                if entry is None or similarity < self.threshold:
+                    continue
+                if self._expired(entry, now):
+                    expired.append(int(entry_id))
+                    continue
+                if entry['source_language'] != source_language:
+                    continue
+                self._remove(expired)
+                self._entries.move_to_end(int(entry_id))
+                self.hits += 1
+                return {**entry, 'similarity': float(similarity)}
+
+            self._remove(expired)
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, query, answer, context_ids, source_language='en'):
+        """Caches a final answer together with the ids of the chunks it was generated from"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(self._normalize(query_vector), np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = {
+                'query': query,
+                'answer': answer,
+                'context_ids': list(context_ids),
+                'source_language': source_language,
+                'created': now,
+            }
+
+            stale = [i for i, entry in self._entries.items() if self._expired(entry, now)]
+            overflow = len(self._entries) - len(stale) - self.max_size
+            if overflow > 0:
+                stale += [i for i in self._entries if i not in stale][:overflow]
+            self._remove(stale)
+
+    def invalidate(self):
+        """Drops every entry, e.g. after the chunk index was rebuilt"""
+        with self._lock:
+            self._entries.clear()
+            self._index.reset()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -1,22 +1,131 @@
 import json
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+from rag_functions import split_sentences
+
 
 
 file_path ='Json_files/Anxiety Disorder.json'
 
 
+# 'section': one chunk per JSON section (the original behaviour)
+# 'sentence': whole sentences packed up to max_tokens, overlapping by up to `overlap` tokens
+# 'window': fixed windows of max_tokens tokens, each starting max_tokens - overlap after the previous one
+# 'sentence' and 'window' keep a section whole when it already fits in max_tokens
+CHUNK_STRATEGIES = ('section', 'sentence', 'window')
+
+# Approximate tokens when no tokenizer is given: one per CJK character, word or punctuation mark
+TOKEN_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|\w+|[^\w\s]')
+
+
+def token_spans(text, tokenizer=None):
+    """
+    (start, end) character offsets of each token in text
 
-def create_chunks_from_json(file_path):
+    Args:
+        text: String to tokenize
+        tokenizer: Optional Hugging Face fast tokenizer (e.g. the embedding model's); defaults to TOKEN_PATTERN
+    """
+    if tokenizer is None:
+        return [match.span() for match in TOKEN_PATTERN.finditer(text)]
+    encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return [span for span in encoded['offset_mapping'] if span[1] > span[0]]
+
+
+def _windows(text, spans, max_tokens, overlap):
+    step = max(max_tokens - overlap, 1)
+    windows = []
+    for start in range(0, len(spans), step):
+        end = min(start + max_tokens, len(spans))
+        windows.append(text[spans[start][0]:spans[end - 1][1]].strip())
+        if end == len(spans):
+            break
+    return windows
+
+
+def _sentence_pack(text, max_tokens, overlap, tokenizer):
+    # (sentence, token count, ends a line) so packed chunks keep the original line breaks
+    sentences = []
+    for line in text.split('\n'):
+        parts = split_sentences(line)
+        for i, sentence in enumerate(parts):
+            spans = token_spans(sentence, tokenizer)
+            if len(spans) > max_tokens:
+                # A single sentence over the limit is cut into windows
+                pieces = _windows(sentence, spans, max_tokens, overlap)
+                sentences.extend((piece, len(token_spans(piece, tokenizer)), False) for piece in pieces)
+                sentences[-1] = (*sentences[-1][:2], i == len(parts) - 1)
+            else:
+                sentences.append((sentence, len(spans), i == len(parts) - 1))
+
+    def join(group):
+        return ''.join(s + ('\n' if ends_line else '') for s, _, ends_line in group).strip()
+
+    chunks = []
+    current, used = [], 0
+    for sentence in sentences:
+        if current and used + sentence[1] > max_tokens:
+            chunks.append(join(current))
+            # Carry trailing sentences into the next chunk, up to `overlap` tokens
+            carried, carried_tokens = [], 0
+            for previous in reversed(current):
+                if carried_tokens + previous[1] > overlap or carried_tokens + previous[1] + sentence[1] > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[1]
+            current, used = carried, carried_tokens
+        current.append(sentence)
+        used += sentence[1]
+    if current:
+        chunks.append(join(current))
+    return chunks
+
+
+def split_section(section_text, strategy='section', max_tokens=256, overlap=32, tokenizer=None):
+    """
+    Splits one section's text into chunk bodies according to a chunking strategy
+
+    Args:
+        section_text: Section content (lines joined with '\n')
+        strategy: One of CHUNK_STRATEGIES
+        max_tokens: Maximum tokens per chunk body (ignored by 'section')
+        overlap: Tokens shared by consecutive chunks of the same section
+        tokenizer: Optional Hugging Face fast tokenizer used to count tokens
+
+    Returns:
+        list: Chunk body strings
+    """
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"strategy must be one of {CHUNK_STRATEGIES}, got {strategy!r}")
+    if strategy == 'section':
+        return [section_text]
+
+    spans = token_spans(section_text, tokenizer)
+    if len(spans) <= max_tokens:
+        # Section-level fallback: small sections stay whole
+        return [section_text]
+    if strategy == 'window':
+        return _windows(section_text, spans, max_tokens, overlap)
+    return _sentence_pack(section_text, max_tokens, overlap, tokenizer)
+
+
+def create_chunks_from_json(file_path, strategy='section', max_tokens=256, overlap=32, tokenizer=None):
     """
     Takes a single JSON file and creates chunks with document and section context.
     
     Args:
         file_path: Path to a single JSON file
+        strategy: Chunking strategy, one of CHUNK_STRATEGIES
+        max_tokens: Maximum tokens per chunk body for 'sentence' and 'window'
+        overlap: Tokens shared by consecutive chunks of the same section
+        tokenizer: Optional Hugging Face fast tokenizer used to count tokens
     
     Returns:
-        list: List of chunk strings with context prepended
+        list: List of chunk dicts (text with context prepended, document, section)
     """
     
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -33,51 +142,151 @@ def create_chunks_from_json(file_path):
         # Combine all content in this section
         section_text = '\n'.join(section['content'])
         
-        # Prepend context: Document name and section name
-        text_with_context = f"文档: {doc_name}\n章节: {section_name}\n\n{section_text}"
-        chunk = {
-            'text': text_with_context,
-            'document': doc_name,
-            'section': section_name
-        }
-        chunks.append(chunk)
+        for body in split_section(section_text, strategy, max_tokens, overlap, tokenizer):
+            # Prepend context: Document name and section name
+            text_with_context = f"文档: {doc_name}\n章节: {section_name}\n\n{body}"
+            chunk = {
+                'text': text_with_context,
+                'document': doc_name,
+                'section': section_name
+            }
+            chunks.append(chunk)
     
     return chunks
 
 
-def create_all_chunks(json_folder='Json_files'):
+def create_chunks_from_scraped_json(file_path, strategy='section', max_tokens=256, overlap=32, tokenizer=None):
     """
-    Loop through all JSON files in folder and create chunks from each.
+    Creates chunks from one scraped English file ({'metadata': {...}, 'sections': [...]}, as written
+    by FJ/scrape_common_diseases.py), carrying category, source_url and scraped_date on each chunk.
     
     Args:
-        json_folder: Path to folder containing JSON files
+        file_path: Path to a scraped JSON file
+        strategy, max_tokens, overlap, tokenizer: See create_chunks_from_json
     
     Returns:
-        list: All chunks from all files
+        list: List of chunk dicts (text, document, section, category, source_url, scraped_date)
     """
-    from pathlib import Path
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
     
-    all_chunks = []
-    json_folder = Path(json_folder)
+    metadata = data.get('metadata', {})
+    doc_name = metadata.get('disease_name') or Path(file_path).stem
+    category = metadata.get('category') or Path(file_path).parent.name
     
-    # Get all JSON file paths
-    json_files = list(json_folder.glob('*.json'))
+    chunks = []
+    for section in data.get('sections', []):
+        section_name = section['section']
+        section_text = '\n'.join(section['content'])
+        
+        for body in split_section(section_text, strategy, max_tokens, overlap, tokenizer):
+            chunks.append({
+                'text': f"Document: {doc_name}\nSection: {section_name}\n\n{body}",
+                'document': doc_name,
+                'section': section_name,
+                'category': category,
+                'source_url': metadata.get('source_url'),
+                'scraped_date': metadata.get('scraped_date'),
+            })
     
-    print(f"Found {len(json_files)} files")
+    return chunks
+
+
+def iter_scraped_chunks(root='common_diseases', workers=None, strategy='section', max_tokens=256, overlap=32,
+                        tokenizer=None):
+    """
+    Walks the scraped <root>/<category>/*.json tree and yields chunks, parsing files in a process pool
+    
+    Args:
+        root: Folder with one sub-folder per category
+        workers: Worker processes (None = one per CPU, 0 = parse in this process)
+        strategy, max_tokens, overlap, tokenizer: See create_chunks_from_json
+    
+    Yields:
+        dict: Chunk dicts, file by file in sorted path order
+    """
+    files = sorted(Path(root).glob('*/*.json'))
+    print(f"Found {len(files)} scraped files under {root}")
+    load = partial(create_chunks_from_scraped_json, strategy=strategy, max_tokens=max_tokens,
+                   overlap=overlap, tokenizer=tokenizer)
+    
+    if workers == 0:
+        for file_path in files:
+            yield from load(file_path)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() keeps file order and only holds the parsed results still waiting to be consumed
+        for chunks in executor.map(load, files, chunksize=8):
+            yield from chunks
+
+
+def iter_chunks(json_folder='Json_files', strategy='section', max_tokens=256, overlap=32, tokenizer=None):
+    """
+    Generator version of create_all_chunks: parses one JSON file at a time and yields its
+    chunks, so ingestion can stream them without holding the whole corpus in memory.
+    
+    Args:
+        json_folder: Path to folder containing JSON files
+        strategy, max_tokens, overlap, tokenizer: See create_chunks_from_json
     
-    # Loop through each file
-    for file_path in json_files:
+    Yields:
+        dict: Chunk dicts in file order
+    """
+    for file_path in sorted(Path(json_folder).glob('*.json')):
         print(f"Processing: {file_path.name}")
-        chunks = create_chunks_from_json(file_path)
-        all_chunks.extend(chunks)  # Add to growing list
+        yield from create_chunks_from_json(file_path, strategy, max_tokens, overlap, tokenizer)
+
+
+def create_all_chunks(json_folder='Json_files', strategy='section', max_tokens=256, overlap=32, tokenizer=None):
+    """
+    Loop through all JSON files in folder and create chunks from each.
     
-    print(f"\nTotal chunks created: {len(all_chunks)}")
+    Args:
+        json_folder: Path to folder containing JSON files
+        strategy, max_tokens, overlap, tokenizer: See create_chunks_from_json
+    
+    Returns:
+        list: All chunks from all files
+    """
+    all_chunks = list(iter_chunks(json_folder, strategy, max_tokens, overlap, tokenizer))
+    print(f"Total chunks created: {len(all_chunks)}")
     return all_chunks
 
 
+# Chunks on disk: one JSON object per line, appendable and readable lazily
+def write_chunks_jsonl(chunks, filename='chunks.jsonl', append=False):
+    """
+    Streams chunks to a JSONL file
+
+    Args:
+        chunks: Iterable of chunk dicts (e.g. iter_chunks(...))
+        filename: Output path
+        append: Add to an existing file instead of replacing it
+
+    Returns:
+        int: Number of chunks written
+    """
+    count = 0
+    with open(filename, 'a' if append else 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+            count += 1
+    print(f"Saved {count} chunks to {filename}")
+    return count
+
+
+def iter_chunks_jsonl(filename='chunks.jsonl'):
+    """Lazily yields the chunk dicts stored in a JSONL file"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
 import pickle
 
-# Save chunks
+# Legacy pickle format (loads every chunk into memory); prefer the JSONL helpers above
 def save_chunks(chunks, filename='chunks.pkl'):
     with open(filename, 'wb') as f:
         pickle.dump(chunks, f)
@@ -90,6 +299,7 @@ def load_chunks(filename='chunks.pkl'):
     print(f"Loaded {len(chunks)} chunks from {filename}")
     return chunks
 
-all_chunks = create_all_chunks()
-save_chunks(all_chunks)
+
+if __name__ == "__main__":
+    write_chunks_jsonl(iter_chunks())
 
@@ -0,0 +1,113 @@
+"""
+Token-budgeted context packing for the LLM prompt.
+
+Retrieved sections are often thousands of characters long, which makes the
+prompt prefill the dominant cost of a request. Instead of joining whole hits,
+the packer splits them into sentences, ranks the sentences by similarity to the
+query, skips near-duplicates and fills a token budget with the best ones. The
+kept sentences are written back per hit, in their original order, under the
+document/section header of the chunk.
+"""
+
+import numpy as np
+
+from rag_functions import split_sentences
+
+
+# Header lines of the Chinese and the scraped English corpus
+HEADER_PREFIXES = ('文档:', '章节:', 'Document:', 'Section:')
+
+
+def chunk_sentences(text):
+    """
+    Splits a chunk's text into sentences, skipping the document/section header lines
+
+    Returns:
+        list: (line index, sentence) pairs
+    """
+    sentences = []
+    for line_index, line in enumerate(text.split('\n')):
+        if line.startswith(HEADER_PREFIXES):
+            continue
+        sentences.extend((line_index, sentence) for sentence in split_sentences(line))
+    return sentences
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def format_hit(hit, lines):
+    """Chunk text with the hit's own header lines and the given {line index: [sentences]}"""
+    header = '\n'.join(line for line in hit['text'].split('\n') if line.startswith(HEADER_PREFIXES))
+    # Sentences ending in Chinese punctuation are joined directly, English ones with a space
+    body = '\n'.join((' ' if line[0][-1].isascii() else '').join(line) for line in (lines[i] for i in sorted(lines)))
+    return f"{header}\n\n{body}"
+
+
+def pack_context(query_vector, hits, encode, count_tokens, token_budget=768, max_distance=None,
+                 dedup_threshold=0.9):
+    """
+    Builds the prompt context for one query within a token budget
+
+    Args:
+        query_vector: Embedding of the query
+        hits: Retrieved hits (dicts with 'text', 'document', 'section', 'distance'), best first
+        encode: Function mapping a list of sentences to an embedding matrix
+        count_tokens: Function returning the LLM token count of a string
+        token_budget: Maximum tokens of sentence text in the packed context
+        max_distance: Drop hits farther than this (the best hit is always kept)
+        dedup_threshold: Cosine similarity above which a sentence counts as a duplicate of one already kept
+
+    Returns:
+        tuple: (context string, stats dict with original/packed tokens and tokens saved)
+    """
+    original = "\n".join(hit['text'] for hit in hits)
+    original_tokens = count_tokens(original) if hits else 0
+
+    kept_hits = [hit for i, hit in enumerate(hits)
+                 if i == 0 or max_distance is None or hit['distance'] <= max_distance]
+
+    # (hit index, line index, sentence) for every sentence of the kept hits
+    candidates = [(h, line_index, sentence)
+                  for h, hit in enumerate(kept_hits)
+                  for line_index, sentence in chunk_sentences(hit['text'])]
+
+    selected = []
+    if candidates:
+        vectors = _normalize_rows(encode([sentence for _, _, sentence in candidates]))
+        query = _normalize_rows(np.asarray(query_vector).reshape(1, -1))[0]
+        scores = vectors @ query
+
+        used = 0
+        kept_vectors = []
+        for i in np.argsort(-scores):
+            if kept_vectors and float(np.max(np.stack(kept_vectors) @ vectors[i])) >= dedup_threshold:
+                continue
+            tokens = count_tokens(candidates[i][2])
+            if used + tokens > token_budget:
+                # A shorter, lower-ranked sentence may still fit
+                continue
+            used += tokens
+            kept_vectors.append(vectors[i])
+            selected.append(i)
+
+    # Reassemble per hit, keeping the original sentence order
+    by_hit = {}
+    for i in sorted(selected):
+        h, line_index, sentence = candidates[i]
+        by_hit.setdefault(h, {}).setdefault(line_index, []).append(sentence)
+    context = "\n".join(format_hit(kept_hits[h], lines) for h, lines in sorted(by_hit.items()))
+
+    packed_tokens = count_tokens(context) if context else 0
+    stats = {
+        'original_tokens': original_tokens,
+        'packed_tokens': packed_tokens,
+        'tokens_saved': original_tokens - packed_tokens,
+        'hits_dropped': len(hits) - len(kept_hits),
+        'sentences_total': len(candidates),
+        'sentences_kept': len(selected),
+    }
+    return context, stats
@@ -0,0 +1,93 @@
+"""
+CPU inference backends for the SentenceTransformer embedding model.
+
+'torch' is the plain fp32 model. 'int8' applies PyTorch dynamic quantization to
+every nn.Linear layer (int8 weights, activations quantized on the fly), and 'onnx'
+runs the same model through ONNX Runtime (sentence-transformers exports it on first
+load; needs `pip install sentence-transformers[onnx]`).
+
+The index is built from fp32 vectors, so a quantized backend is only usable for
+queries if its embeddings stay close to the fp32 ones; check_agreement measures that.
+"""
+
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from torch_settings import quantize_int8
+
+
+EMBEDDING_BACKENDS = ('torch', 'int8', 'onnx')
+
+# Fixed Chinese and English medical sentences for the agreement check
+AGREEMENT_SENTENCES = [
+    "糖尿病的常见症状包括多饮、多尿和体重下降。",
+    "高血压患者应限制钠盐摄入并规律服用降压药。",
+    "哮喘急性发作时可使用短效β2受体激动剂缓解症状。",
+    "乙型肝炎病毒主要通过血液、母婴和性接触传播。",
+    "骨质疏松症的预防需要补充钙和维生素D。",
+    "What are the symptoms of anxiety disorder?",
+    "Metformin is the first-line treatment for type 2 diabetes.",
+    "Stroke risk factors include hypertension, smoking and atrial fibrillation.",
+]
+
+
+def load_embedding_model(model_name, backend='torch'):
+    """
+    Loads a SentenceTransformer with the given inference backend
+
+    Args:
+        model_name: Hugging Face model name, e.g. 'moka-ai/m3e-base'
+        backend: One of EMBEDDING_BACKENDS
+
+    Returns:
+        SentenceTransformer: Model with the usual encode() interface
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"embedding backend must be one of {EMBEDDING_BACKENDS}, got {backend!r}")
+    if backend == 'onnx':
+        return SentenceTransformer(model_name, backend='onnx')
+    model = SentenceTransformer(model_name, device='cpu' if backend == 'int8' else None)
+    if backend == 'int8':
+        model = quantize_int8(model)
+    return model
+
+
+def cosine_agreement(reference, candidate):
+    """Row-wise cosine similarity between two embedding matrices"""
+    reference = np.asarray(reference, dtype='float32')
+    candidate = np.asarray(candidate, dtype='float32')
+    dots = np.sum(reference * candidate, axis=1)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return dots / np.maximum(norms, 1e-12)
+
+
+def check_agreement(reference_model, model, sentences=AGREEMENT_SENTENCES, min_cosine=0.99):
+    """
+    Compares a backend's embeddings to the fp32 model's on fixed sentences
+
+    Args:
+        reference_model: fp32 SentenceTransformer
+        model: Model under test
+        sentences: Sentences to embed with both
+        min_cosine: Lowest acceptable per-sentence cosine similarity
+
+    Returns:
+        dict: 'min_cosine', 'mean_cosine' and 'passed'
+    """
+    similarities = cosine_agreement(reference_model.encode(sentences), model.encode(sentences))
+    return {
+        'min_cosine': float(similarities.min()),
+        'mean_cosine': float(similarities.mean()),
+        'passed': bool(similarities.min() >= min_cosine),
+    }
+
+
+def sentences_per_second(model, sentences, batch_size=64, repeats=3):
+    """Encoding throughput of a model, after one warmup call"""
+    model.encode(sentences[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.encode(sentences, batch_size=batch_size)
+    return repeats * len(sentences) / (time.perf_counter() - start)
@@ -0,0 +1,434 @@
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+
+# Candidate search settings tried by auto_tune, cheapest first
+NPROBE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+EF_SEARCH_CANDIDATES = [16, 32, 48, 64, 96, 128, 256, 512]
+
+# Compressed vector storage: bytes per vector are d (SQ8), d / 2 (SQ4) and d / 8 (PQ) instead of 4 * d
+COMPRESSIONS = ('sq8', 'sq4', 'pq')
+
+
+def create_index(dimension, index_factory='Flat'):
+    """
+    Builds an empty FAISS index from a factory string
+
+    Args:
+        dimension: Embedding dimension
+        index_factory: FAISS factory string, e.g. 'Flat', 'IVF256,Flat', 'HNSW32' or 'IVF256,PQ32'
+
+    Returns:
+        faiss.Index: Empty (possibly untrained) index using L2 distance whose vectors are keyed
+        by the chunks.id primary key. IVF indexes store ids in their inverted lists; every other
+        type is wrapped in an IndexIDMap. (IndexIDMap.remove_ids assumes the inner index shifts
+        later vectors down, which IVF does not, so a wrapped IVF would mislabel vectors.)
+    """
+    if index_factory.startswith('IDMap'):
+        index_factory = index_factory.split(',', 1)[1]
+    index = faiss.index_factory(dimension, index_factory, faiss.METRIC_L2)
+    if faiss.try_extract_index_ivf(index) is not None:
+        return index
+    return faiss.index_factory(dimension, f"IDMap,{index_factory}", faiss.METRIC_L2)
+
+
+def compressed_factory(compression, dimension, n_vectors=None):
+    """
+    Factory string for a compressed flat index
+
+    Args:
+        compression: 'sq8' / 'sq4' (per-dimension 8 / 4 bit scalar quantization) or 'pq'
+            (product quantization, one byte per 8 dimensions)
+        dimension: Embedding dimension
+        n_vectors: Number of training vectors; PQ falls back to 4-bit codes below 256,
+            since 8-bit codebooks need at least 256 training points
+
+    Returns:
+        str: e.g. 'SQ8', 'SQ4' or 'PQ96' for 768 dimensions
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be one of {COMPRESSIONS}, got {compression!r}")
+    if compression != 'pq':
+        return compression.upper()
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    if n_vectors is not None and n_vectors < 256:
+        return f"PQ{m}x4"
+    return f"PQ{m}"
+
+
+def index_size_bytes(index):
+    """Serialized size of an index, i.e. the memory its vectors take once loaded"""
+    return faiss.serialize_index(index).nbytes
+
+
+def _is_id_map(index):
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def stored_ids(index):
+    """
+    Ids of the vectors in an IndexIDMap, in insertion order, or in an IVF index, list by list
+
+    Returns:
+        np.ndarray: int64 ids
+    """
+    if _is_id_map(index):
+        return faiss.vector_to_array(faiss.downcast_index(index).id_map)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        raise ValueError("Index stores no ids")
+    invlists = ivf.invlists
+    parts = [faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+             for list_no in range(ivf.nlist) if invlists.list_size(list_no)]
+    return np.concatenate(parts).astype('int64') if parts else np.zeros(0, dtype='int64')
+
+
+def has_id_map(index):
+    """True if the index stores explicit ids rather than insertion positions"""
+    if _is_id_map(index):
+        return True
+    if faiss.try_extract_index_ivf(index) is not None:
+        # IVF indexes filled with add() before ids were used hold the positions 0..n-1;
+        # chunk ids start at 1, so an id 0 marks such a legacy index
+        return not np.any(stored_ids(index) == 0)
+    return False
+
+
+def _reconstruct_all(index):
+    """All vectors of an index in insertion order (IVF needs a direct map for this)"""
+    inner = faiss.downcast_index(index).index if _is_id_map(index) else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return inner.reconstruct_n(0, inner.ntotal)
+
+
+def ensure_id_map(index, ids, index_factory='Flat'):
+    """
+    Converts a legacy position-keyed index (where FAISS position p was assumed to be
+    SQLite row p + 1) into an index keyed by the real chunk ids
+
+    Args:
+        index: FAISS index loaded from disk
+        ids: Chunk ids in insertion order, one per stored vector
+        index_factory: Factory string used to rebuild the index
+
+    Returns:
+        faiss.Index: The same index if it already has ids, otherwise an id-keyed copy
+    """
+    if has_id_map(index):
+        return index
+
+    ids = np.asarray(ids, dtype='int64')
+    if len(ids) != index.ntotal:
+        raise ValueError(f"Cannot map {index.ntotal} vectors onto {len(ids)} chunk ids")
+
+    print("Migrating position-keyed FAISS index to chunk ids...")
+    vectors = _reconstruct_all(index)
+    id_index = create_index(index.d, index_factory)
+    copy_search_params(index, id_index)
+    train_index(id_index, vectors)
+    id_index.add_with_ids(vectors, ids)
+    return id_index
+
+
+def remove_ids(index, ids, index_factory='Flat'):
+    """
+    Removes vectors by chunk id. Indexes that cannot delete in place (HNSW), and IVF
+    indexes saved inside an IndexIDMap (whose id_map removal would mislabel the remaining
+    vectors), are rebuilt from the vectors that remain.
+
+    Args:
+        index: Id-keyed FAISS index (see create_index)
+        ids: Chunk ids to remove
+        index_factory: Factory string used if the index has to be rebuilt
+
+    Returns:
+        faiss.Index: The same index, or the rebuilt one
+    """
+    ids = np.asarray(ids, dtype='int64')
+    if len(ids) == 0:
+        return index
+    wrapped_ivf = _is_id_map(index) and faiss.try_extract_index_ivf(faiss.downcast_index(index).index) is not None
+    if not wrapped_ivf:
+        try:
+            index.remove_ids(ids)
+            return index
+        except RuntimeError:
+            pass
+
+    print(f"Index cannot remove ids in place, rebuilding it without {len(ids)} vectors...")
+    labels = stored_ids(index)
+    keep = ~np.isin(labels, ids)
+    vectors = _reconstruct_all(index)[keep]
+    rebuilt = create_index(index.d, index_factory)
+    copy_search_params(index, rebuilt)
+    train_index(rebuilt, vectors)
+    rebuilt.add_with_ids(vectors, labels[keep])
+    return rebuilt
+
+
+def check_remove_ids(index_factory, dimension=32, n=500, n_removed=50, seed=0):
+    """
+    Regression check for remove_ids: removes some ids and verifies that every remaining
+    vector still finds the same nearest neighbour as before, and no removed id is returned
+
+    Returns:
+        float: Fraction of remaining vectors whose top-1 result is unchanged
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((n, dimension), dtype='float32')
+    ids = np.arange(1, n + 1, dtype='int64')
+    index = create_index(dimension, index_factory)
+    train_index(index, vectors)
+    index.add_with_ids(vectors, ids)
+    set_search_params(index, **{key: 1024 for key in get_search_params(index)})
+    _, before = index.search(vectors, 1)
+
+    removed = rng.choice(ids, size=n_removed, replace=False)
+    index = remove_ids(index, removed, index_factory)
+    set_search_params(index, **{key: 1024 for key in get_search_params(index)})
+    keep = ~np.isin(ids, removed) & ~np.isin(before[:, 0], removed)
+    _, after = index.search(vectors[keep], 1)
+
+    if np.isin(after, removed).any():
+        return 0.0
+    return float(np.mean(after[:, 0] == before[keep, 0]))
+
+
+def train_index(index, vectors):
+    """
+    Trains the index on the ingested vectors if it needs training (IVF, PQ)
+
+    Args:
+        index: FAISS index
+        vectors: float32 matrix of shape (n, dimension)
+    """
+    if index.is_trained:
+        return
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    print(f"Training index on {len(vectors)} vectors...")
+    start = time.perf_counter()
+    index.train(vectors)
+    print(f"✓ Trained index in {time.perf_counter() - start:.1f}s")
+
+
+def _find_hnsw(index):
+    """Returns the HNSW layer of an index (looking through wrappers) or None"""
+    index = faiss.downcast_index(index)
+    while not isinstance(index, faiss.IndexHNSW):
+        inner = getattr(index, 'index', None) or getattr(index, 'base_index', None)
+        if inner is None:
+            return None
+        index = faiss.downcast_index(inner)
+    return index
+
+
+def set_search_params(index, nprobe=None, efSearch=None):
+    """
+    Sets the query-time knobs of an approximate index. Parameters that are None are left as is.
+
+    Args:
+        index: FAISS index
+        nprobe: Number of IVF lists visited per query
+        efSearch: Size of the HNSW candidate list per query
+    """
+    params = faiss.ParameterSpace()
+    if nprobe is not None:
+        params.set_index_parameter(index, 'nprobe', int(nprobe))
+    if efSearch is not None:
+        params.set_index_parameter(index, 'efSearch', int(efSearch))
+
+
+def get_search_params(index):
+    """
+    Returns the current query-time knobs of an index
+
+    Returns:
+        dict: {'nprobe': ...} for IVF indexes, {'efSearch': ...} for HNSW, {} for flat
+    """
+    params = {}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params['nprobe'] = ivf.nprobe
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        params['efSearch'] = hnsw.hnsw.efSearch
+    return params
+
+
+def copy_search_params(source, target):
+    """Copies nprobe / efSearch from one index to another, skipping knobs the target does not have"""
+    supported = get_search_params(target)
+    set_search_params(target, **{key: value for key, value in get_search_params(source).items() if key in supported})
+
+
+def search_parameters(index, selector=None, widen=1):
+    """
+    SearchParameters matching the index type, carrying an ID selector and the current
+    nprobe / efSearch multiplied by `widen` (capped at an exhaustive search)
+
+    Returns:
+        tuple: (faiss.SearchParameters, True if the setting is already exhaustive)
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nprobe * widen, ivf.nlist)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe), nprobe >= ivf.nlist
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        ef_search = min(hnsw.hnsw.efSearch * widen, max(index.ntotal, 1))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search), ef_search >= index.ntotal
+    return faiss.SearchParameters(sel=selector), True
+
+
+def filtered_search(index, query_vectors, k, ids):
+    """
+    Searches only among the given chunk ids, with the restriction applied inside FAISS
+    (IDSelectorBatch) rather than by post-filtering. IVF and HNSW can miss selected
+    vectors outside the probed lists / candidate graph; rows that come back short are
+    searched again with a 4x wider nprobe / efSearch until they are full or the search
+    is exhaustive, so k results are returned whenever k matching chunks exist.
+
+    Args:
+        index: IndexIDMap-wrapped FAISS index
+        query_vectors: float32 matrix of shape (n, dimension)
+        k: Number of neighbours
+        ids: Allowed chunk ids
+
+    Returns:
+        tuple: (distances, labels) as from index.search, -1 labels where fewer than k ids exist
+    """
+    query_vectors = np.ascontiguousarray(query_vectors, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    if len(ids) == 0:
+        return (np.full((len(query_vectors), k), np.inf, dtype='float32'),
+                np.full((len(query_vectors), k), -1, dtype='int64'))
+
+    selector = faiss.IDSelectorBatch(ids)
+    params, exhaustive = search_parameters(index, selector)
+    distances, labels = index.search(query_vectors, k, params=params)
+
+    wanted = min(k, len(ids))
+    widen = 1
+    while not exhaustive:
+        short = np.flatnonzero((labels >= 0).sum(axis=1) < wanted)
+        if len(short) == 0:
+            break
+        widen *= 4
+        params, exhaustive = search_parameters(index, selector, widen)
+        distances[short], labels[short] = index.search(query_vectors[short], k, params=params)
+    return distances, labels
+
+
+def recall_at_k(found, ground_truth, k):
+    """Fraction of the exact top-k neighbours that appear in the approximate top-k"""
+    hits = 0
+    for row, truth in zip(found, ground_truth):
+        hits += len(set(row[:k]) & set(truth[:k]))
+    return hits / (len(ground_truth) * k)
+
+
+def _candidate_settings(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return [{'nprobe': n} for n in NPROBE_CANDIDATES if n <= ivf.nlist]
+    if _find_hnsw(index) is not None:
+        return [{'efSearch': ef} for ef in EF_SEARCH_CANDIDATES]
+    return []
+
+
+def auto_tune(index, vectors, queries, k=3, target_recall=0.95, repeats=3, ids=None):
+    """
+    Picks the fastest nprobe / efSearch setting whose recall@k against an exact
+    flat index meets the target, and applies it to the index
+
+    Args:
+        index: Trained and filled FAISS index
+        vectors: The vectors stored in the index, in insertion order
+        queries: float32 query matrix used for the measurement
+        k: Number of neighbours for recall@k
+        target_recall: Minimum recall@k the chosen setting must reach
+        repeats: Number of timed search passes per setting
+        ids: Ids the vectors were added under (defaults to their positions)
+
+    Returns:
+        dict: Chosen setting plus the measured recall/latency of every candidate
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    queries = np.ascontiguousarray(queries, dtype='float32')
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, k)
+    if ids is not None:
+        ground_truth = np.asarray(ids, dtype='int64')[ground_truth]
+
+    candidates = _candidate_settings(index)
+    if not candidates:
+        print("Index is exact, nothing to tune")
+        return {'setting': {}, 'recall': 1.0, 'results': []}
+
+    results = []
+    for setting in candidates:
+        set_search_params(index, **setting)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, found = index.search(queries, k)
+        latency_ms = (time.perf_counter() - start) / (repeats * len(queries)) * 1000
+        recall = recall_at_k(found, ground_truth, k)
+        results.append({'setting': setting, 'recall': recall, 'latency_ms': latency_ms})
+        print(f"  {setting} recall@{k}={recall:.3f} latency={latency_ms:.3f}ms/query")
+
+    passing = [r for r in results if r['recall'] >= target_recall]
+    if passing:
+        best = min(passing, key=lambda r: r['latency_ms'])
+    else:
+        print(f"⚠ WARNING: no setting reached recall@{k} >= {target_recall}, using the most accurate one")
+        best = max(results, key=lambda r: (r['recall'], -r['latency_ms']))
+
+    set_search_params(index, **best['setting'])
+    print(f"✓ Selected {best['setting']} (recall@{k}={best['recall']:.3f}, {best['latency_ms']:.3f}ms/query)")
+    return {'setting': best['setting'], 'recall': best['recall'], 'results': results}
+
+
+def config_path(faiss_path):
+    """Path of the JSON sidecar that stores how an index was built"""
+    return f"{faiss_path}.json"
+
+
+def save_index_config(faiss_path, index_factory, index, corpus_language='zh', rerank_factor=None):
+    """Writes the factory string, search parameters, corpus language and re-ranking factor next to the saved index"""
+    config = {
+        'index_factory': index_factory,
+        'dimension': index.d,
+        'search_params': get_search_params(index),
+        'corpus_language': corpus_language,
+        'rerank_factor': rerank_factor,
+    }
+    with open(config_path(faiss_path), 'w') as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def load_index_config(faiss_path):
+    """Reads the sidecar written by save_index_config, or returns a flat-index default"""
+    path = config_path(faiss_path)
+    if not os.path.exists(path):
+        return {'index_factory': 'Flat', 'search_params': {}, 'corpus_language': 'zh'}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # python index_factory.py: remove-then-search regression check for each index type
+    for factory in ['Flat', 'SQ8', 'SQ4', 'PQ8', 'IVF8,Flat', 'IVF8,SQ8', 'IVF8,PQ8', 'HNSW32']:
+        agreement = check_remove_ids(factory)
+        mark = '✓' if agreement >= 0.95 else '⚠'
+        print(f"{mark} {factory}: {agreement:.1%} of remaining vectors keep their nearest neighbour after remove_ids")
@@ -0,0 +1,141 @@
+"""
+Lexical (BM25) retrieval over an SQLite FTS5 index of the chunks.
+
+FTS5's built-in tokenizers do not segment Chinese, so chunk text is tokenized here
+before it is stored: runs of CJK characters become single characters plus overlapping
+character bigrams, and Latin words / numbers stay whole. The table only holds these
+token strings; rowid is the chunk id, so hits join straight back onto `chunks`.
+"""
+
+import json
+import re
+
+from rag_functions import SQLITE_MAX_PARAMS
+
+
+CJK_RUN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+TOKEN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+|[A-Za-z0-9]+')
+
+# Question words and punctuation that mark a query as a sentence rather than keywords
+QUESTION_MARKERS = re.compile(r'[?？。，,]|什么|怎么|如何|为什么|哪些|是否|\b(what|how|why|which|when|does|is|are)\b',
+                              re.IGNORECASE)
+
+
+def _cjk_ngrams(run, unigrams):
+    bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+    if unigrams or len(run) == 1:
+        return list(run) + bigrams
+    return bigrams
+
+
+def ngram_tokens(text, unigrams=True):
+    """
+    Space-separated FTS5 tokens for a text: CJK characters and bigrams, lower-cased Latin words
+
+    Args:
+        text: Chunk or query text
+        unigrams: Include single CJK characters (always kept for one-character runs)
+    """
+    tokens = []
+    for match in TOKEN.finditer(text):
+        token = match.group()
+        if CJK_RUN.fullmatch(token):
+            tokens.extend(_cjk_ngrams(token, unigrams))
+        else:
+            tokens.append(token.lower())
+    return ' '.join(tokens)
+
+
+def match_expression(query):
+    """FTS5 MATCH string OR-ing the query's bigrams / words, so BM25 ranks partial matches too"""
+    tokens = list(dict.fromkeys(ngram_tokens(query, unigrams=False).split()))
+    return ' OR '.join(f'"{token}"' for token in tokens)
+
+
+def is_keyword_query(query, max_chars=12, max_words=4):
+    """Short queries without question words (e.g. '二甲双胍', 'metformin dose') are answered lexically"""
+    query = query.strip()
+    if not query or QUESTION_MARKERS.search(query):
+        return False
+    return len(query) <= max_chars or (len(query.split()) <= max_words and not CJK_RUN.search(query))
+
+
+def has_fts_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone() is not None
+
+
+def create_fts_table(conn):
+    """
+    Creates the chunks_fts table and fills it from chunks if it is new
+
+    Returns:
+        int: Number of chunks indexed now (0 if the table already existed)
+    """
+    if has_fts_table(conn):
+        return 0
+    conn.execute("CREATE VIRTUAL TABLE chunks_fts USING fts5(tokens)")
+    rows = conn.execute("SELECT id, text FROM chunks").fetchall()
+    index_chunks(conn, [row[0] for row in rows], [row[1] for row in rows])
+    return len(rows)
+
+
+def index_chunks(conn, ids, texts):
+    """Adds chunks (by id) to the FTS index"""
+    conn.executemany("INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                     [(chunk_id, ngram_tokens(text)) for chunk_id, text in zip(ids, texts)])
+
+
+def delete_chunks(conn, ids):
+    """Removes chunks (by id) from the FTS index"""
+    ids = [int(i) for i in ids]
+    for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+        part = ids[start:start + SQLITE_MAX_PARAMS]
+        conn.execute(f"DELETE FROM chunks_fts WHERE rowid IN ({','.join('?' * len(part))})", part)
+
+
+def lexical_search(cursor, queries, k=3, ids=None):
+    """
+    BM25 search for many queries
+
+    Args:
+        cursor: SQLite cursor
+        queries: List of query strings
+        k: Number of chunks per query
+        ids: Optional allowed chunk ids (metadata filter)
+
+    Returns:
+        list: Per query, a ranked list of (chunk id, bm25 score) pairs; lower scores are better
+    """
+    restrict = ""
+    params = []
+    if ids is not None:
+        # One JSON parameter instead of one placeholder per id
+        restrict = "AND rowid IN (SELECT value FROM json_each(?))"
+        params = [json.dumps([int(i) for i in ids])]
+
+    results = []
+    for query in queries:
+        expression = match_expression(query)
+        if not expression:
+            results.append([])
+            continue
+        cursor.execute(
+            f"SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? {restrict} "
+            f"ORDER BY bm25(chunks_fts) LIMIT ?",
+            [expression, *params, k])
+        results.append(cursor.fetchall())
+    return results
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several ranked id lists: score(id) = sum over lists of 1 / (k + rank)
+
+    Returns:
+        list: (id, fused score) pairs, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
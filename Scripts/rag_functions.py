@@ -1,9 +1,67 @@
-def vectorize_query_retrieve(user_query, embedding_model, faiss_index, cursor):
-    # 1. Vectorize query
-    query_vector = embedding_model.encode(user_query)
-    query_vector = query_vector.reshape(1, -1).astype('float32')
+import hashlib
+import re
+
+import numpy as np
+
+from index_factory import filtered_search
+
+
+# Split after Chinese/full-width terminators, or after '.', '!', '?', ';' followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？；])|(?<=[.!?;])\s+')
+
+
+def split_sentences(text):
+    """
+    Splits one line of Chinese or English text into sentences, keeping the punctuation
+
+    Args:
+        text: Text without newlines (split paragraphs on '\\n' first)
+
+    Returns:
+        list: Non-empty, stripped sentences
+    """
+    return [part.strip() for part in SENTENCE_BOUNDARY.split(text) if part and part.strip()]
+
+
+# Characters that end a sentence in streamed (mostly Chinese) LLM output
+SENTENCE_END = re.compile(r'[。！？；!?\n]')
+
+
+def split_complete_sentences(buffer):
+    """
+    Splits a streaming text buffer after its last sentence terminator
+
+    Args:
+        buffer: Text received so far that has not been emitted yet
+
+    Returns:
+        tuple: (text made of complete sentences, unfinished remainder)
+    """
+    last = None
+    for last in SENTENCE_END.finditer(buffer):
+        pass
+    if last is None:
+        return "", buffer
+    return buffer[:last.end()], buffer[last.end():]
+
+
+def content_hash(text):
+    """SHA-256 hex digest of a chunk's text (or a file's bytes), used to detect changed content"""
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return hashlib.sha256(data).hexdigest()
+
+
+def vectorize_query_retrieve(user_query, embedding_model, faiss_index, cursor, chunk_store=None, query_vector=None):
+    """
+    Debug helper: prints and returns the raw FAISS top 3 for one query. It does not re-rank
+    compressed indexes or apply search modes; RAG.query_chunks does both.
+    """
+    # 1. Vectorize query (unless a cached vector was passed in)
+    if query_vector is None:
+        query_vector = embedding_model.encode(user_query)
+    query_vector = np.asarray(query_vector).reshape(1, -1).astype('float32')
     
-    # 2. Search FAISS
+    # 2. Search FAISS (labels are chunks.id primary keys, -1 pads missing hits)
     k = 3
     distances, indices = faiss_index.search(query_vector, k)
     
@@ -11,18 +69,238 @@ def vectorize_query_retrieve(user_query, embedding_model, faiss_index, cursor):
     print(f"\nQuery: '{user_query}'")
     print(f"Query vector (first 10 dims): {query_vector[0][:10]}\n")
     
+    rows = lookup_chunks(indices[0], cursor, chunk_store)
     chunks = []
     for idx, distance in zip(indices[0], distances[0]):
-        sqlite_id = int(idx) + 1
-        cursor.execute("SELECT text FROM chunks WHERE id = ?", (sqlite_id,))
-        result = cursor.fetchone()
+        result = rows.get(int(idx))
         if result:
-            chunks.append(result[0])
-            print(f"Distance: {distance:.4f} | {result[0]}")
+            chunks.append(result['text'])
+            print(f"Distance: {distance:.4f} | {result['text']}")
     
     return chunks
 
 
+# Stay below SQLite's bound-parameter limit on older builds
+SQLITE_MAX_PARAMS = 900
+
+
+# Optional per-chunk metadata columns (set by the scraped English corpus, NULL otherwise)
+METADATA_COLUMNS = ('category', 'source_url', 'scraped_date')
+
+
+def chunk_row(chunk_id, chunk):
+    """In-memory representation of a stored chunk, as returned by fetch_chunks"""
+    row = {'id': chunk_id, 'text': chunk['text'], 'document': chunk['document'], 'section': chunk['section']}
+    row.update((column, chunk.get(column)) for column in METADATA_COLUMNS)
+    return row
+
+
+def _chunk_columns(cursor):
+    # Every stored column but the embedding blob; databases written before the
+    # metadata columns existed lack some of them
+    cursor.execute("PRAGMA table_info(chunks)")
+    return ', '.join(row[1] for row in cursor.fetchall() if row[1] != 'embedding')
+
+
+def _rows_to_chunks(cursor):
+    columns = [description[0] for description in cursor.description]
+    chunks = {}
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        chunks[row['id']] = chunk_row(row['id'], row)
+    return chunks
+
+
+# Metadata columns retrieval can be restricted to
+FILTER_COLUMNS = ('document', 'section', 'category')
+
+
+def select_chunk_ids(cursor, chunk_store=None, **filters):
+    """
+    Ids of the chunks matching metadata filters
+
+    Args:
+        cursor: SQLite cursor
+        chunk_store: Optional in-memory id -> chunk map (filtered without touching SQLite)
+        **filters: FILTER_COLUMNS name -> value or list of accepted values; None means no restriction
+
+    Returns:
+        np.ndarray: int64 chunk ids
+    """
+    unknown = set(filters) - set(FILTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown filter(s) {sorted(unknown)}, expected {FILTER_COLUMNS}")
+    filters = {column: [value] if isinstance(value, str) else list(value)
+               for column, value in filters.items() if value is not None}
+
+    if chunk_store is not None:
+        ids = [chunk_id for chunk_id, chunk in chunk_store.items()
+               if all(chunk.get(column) in values for column, values in filters.items())]
+        return np.asarray(ids, dtype='int64')
+
+    where = ' AND '.join(f"{column} IN ({','.join('?' * len(values))})" for column, values in filters.items())
+    params = [value for values in filters.values() for value in values]
+    cursor.execute(f"SELECT id FROM chunks WHERE {where or '1'}", params)
+    return np.asarray([row[0] for row in cursor.fetchall()], dtype='int64')
+
+
+def fetch_chunks(cursor, ids):
+    """
+    Fetches text and metadata for many chunk ids with one IN (...) query
+
+    Args:
+        cursor: SQLite cursor
+        ids: Iterable of chunk ids
+
+    Returns:
+        dict: id -> {'id', 'text', 'document', 'section', 'category', 'source_url', 'scraped_date'}
+    """
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    rows = {}
+    if not ids:
+        return rows
+    columns = _chunk_columns(cursor)
+    for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+        part = ids[start:start + SQLITE_MAX_PARAMS]
+        placeholders = ','.join('?' * len(part))
+        cursor.execute(f"SELECT {columns} FROM chunks WHERE id IN ({placeholders})", part)
+        rows.update(_rows_to_chunks(cursor))
+    return rows
+
+
+def fetch_embeddings(cursor, ids):
+    """
+    Fetches the original (uncompressed) embeddings stored with the chunks
+
+    Args:
+        cursor: SQLite cursor
+        ids: Iterable of chunk ids
+
+    Returns:
+        dict: id -> float32 vector, for the chunks that have a stored embedding
+    """
+    ids = list(dict.fromkeys(int(i) for i in ids if i >= 0))
+    vectors = {}
+    for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+        part = ids[start:start + SQLITE_MAX_PARAMS]
+        cursor.execute(f"SELECT id, embedding FROM chunks WHERE embedding IS NOT NULL "
+                       f"AND id IN ({','.join('?' * len(part))})", part)
+        vectors.update((chunk_id, np.frombuffer(blob, dtype='float32')) for chunk_id, blob in cursor.fetchall())
+    return vectors
+
+
+def rerank_exact(query_vectors, distances, labels, cursor, k):
+    """
+    Re-scores approximate search results by exact L2 distance to the stored embeddings
+    and keeps the best k per query. Candidates without a stored embedding keep their
+    approximate distance.
+
+    Args:
+        query_vectors: float32 matrix of shape (n, dimension)
+        distances, labels: Candidate results from index.search (-1 labels are padding)
+        cursor: SQLite cursor
+        k: Number of results kept per query
+
+    Returns:
+        tuple: (distances, labels) of shape (n, k), squared L2 like IndexFlatL2
+    """
+    vectors = fetch_embeddings(cursor, labels.flat)
+    out_distances = np.full((len(labels), k), np.inf, dtype='float32')
+    out_labels = np.full((len(labels), k), -1, dtype='int64')
+    for row, (query, row_distances, row_labels) in enumerate(zip(query_vectors, distances, labels)):
+        scored = []
+        for distance, label in zip(row_distances, row_labels):
+            if label < 0:
+                continue
+            vector = vectors.get(int(label))
+            if vector is not None:
+                distance = float(np.sum((vector - query) ** 2))
+            scored.append((distance, label))
+        scored.sort(key=lambda item: item[0])
+        for j, (distance, label) in enumerate(scored[:k]):
+            out_distances[row, j] = distance
+            out_labels[row, j] = label
+    return out_distances, out_labels
+
+
+def load_chunk_store(cursor):
+    """
+    Loads every chunk into an in-memory id -> chunk map so retrieval never touches SQLite
+
+    Args:
+        cursor: SQLite cursor
+
+    Returns:
+        dict: id -> chunk dict as returned by fetch_chunks
+    """
+    cursor.execute(f"SELECT {_chunk_columns(cursor)} FROM chunks")
+    return _rows_to_chunks(cursor)
+
+
+def lookup_chunks(ids, cursor, chunk_store=None):
+    """
+    Resolves FAISS labels to chunks, from the in-memory store if loaded, else with one SQL query.
+    Negative labels (FAISS padding for missing hits) are ignored.
+    """
+    ids = [int(i) for i in ids if i >= 0]
+    if chunk_store is not None:
+        return {i: chunk_store[i] for i in ids if i in chunk_store}
+    return fetch_chunks(cursor, ids)
+
+
+def vectorize_queries_retrieve_batch(queries, embedding_model, faiss_index, cursor, k=3, batch_size=64,
+                                     chunk_store=None, query_vectors=None, ids=None, rerank_factor=None):
+    """
+    Batched version of vectorize_query_retrieve: one encode call, one FAISS search
+    over the whole query matrix and one SQL round trip for all hits
+
+    Args:
+        queries: List of query strings
+        embedding_model: SentenceTransformer model
+        faiss_index: FAISS index
+        cursor: SQLite cursor
+        k: Number of chunks retrieved per query
+        batch_size: Batch size passed to SentenceTransformer.encode
+        chunk_store: Optional in-memory id -> chunk map from load_chunk_store
+        query_vectors: Optional precomputed query matrix (skips encoding)
+        ids: Optional allowed chunk ids (see select_chunk_ids), applied inside the FAISS search
+        rerank_factor: For compressed indexes, search k * rerank_factor candidates and
+            re-rank them by exact distance to the stored original embeddings
+
+    Returns:
+        list: One list per query of hit dicts with 'id', 'text', 'document', 'section' and 'distance'
+    """
+    if not queries:
+        return []
+
+    # 1. Vectorize all queries at once
+    if query_vectors is None:
+        query_vectors = embedding_model.encode(list(queries), batch_size=batch_size)
+    query_vectors = np.asarray(query_vectors, dtype='float32').reshape(len(queries), -1)
+
+    # 2. Search FAISS with the full query matrix
+    n_candidates = k * rerank_factor if rerank_factor else k
+    if ids is None:
+        distances, indices = faiss_index.search(query_vectors, n_candidates)
+    else:
+        distances, indices = filtered_search(faiss_index, query_vectors, n_candidates, ids)
+    if rerank_factor:
+        distances, indices = rerank_exact(query_vectors, distances, indices, cursor, k)
+
+    # 3. Fetch every hit in a single query (FAISS labels are chunks.id primary keys)
+    rows = lookup_chunks(indices.flat, cursor, chunk_store)
+
+    results = []
+    for row_ids, row_distances in zip(indices, distances):
+        hits = []
+        for chunk_id, distance in zip(row_ids, row_distances):
+            chunk = rows.get(int(chunk_id))
+            if chunk:
+                hits.append({**chunk, 'distance': float(distance)})
+        results.append(hits)
+    return results
+
+
 def embed_add(chunk_dict, embedding_model, faiss_index, cursor):
     """
     Converts the text to vector, adds to FAISS, and stores in SQLite with metadata
@@ -32,37 +310,66 @@ def embed_add(chunk_dict, embedding_model, faiss_index, cursor):
         embedding_model: SentenceTransformer model
         faiss_index: FAISS index
         cursor: SQLite cursor
+
+    Returns:
+        int: The chunk id (SQLite primary key and FAISS label)
     """
     # 1. Vectorize (only the text gets embedded)
     vector = embedding_model.encode(chunk_dict['text'])
     vector = vector.reshape(1, -1).astype('float32')
 
-    # 2. Add to FAISS
-    faiss_index.add(vector)
-
-    # 3. Add to SQLite with metadata
+    # 2. Add to SQLite with metadata
     cursor.execute(
-        "INSERT INTO chunks (text, document, section) VALUES (?, ?, ?)",
-        (chunk_dict['text'], chunk_dict['document'], chunk_dict['section'])
+        "INSERT INTO chunks (text, document, section, content_hash, category, source_url, scraped_date, embedding) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (chunk_dict['text'], chunk_dict['document'], chunk_dict['section'], content_hash(chunk_dict['text']),
+         *(chunk_dict.get(column) for column in METADATA_COLUMNS), vector.tobytes())
     )
+    chunk_id = cursor.lastrowid
 
-def process_and_store_chunks():
-  all_chunks = create_all_chunks('Json_files')
-  save_chunks(all_chunks)
-  print(f"Created {len(all_chunks)} chunks")
+    # 3. Add to FAISS keyed by the row's primary key
+    faiss_index.add_with_ids(vector, np.array([chunk_id], dtype='int64'))
+    return chunk_id
 
-  dimension = 768
-  embedding_model = 'moka-ai/m3e-base'
-  llm_model = "Qwen/Qwen2-1.5B-Instruct"
 
-  rag = RAG(dimension=dimension, embedding_model=embedding_model, model_name=llm_model)
+def embed_add_batch(chunk_dicts, embedding_model, faiss_index, cursor, batch_size=64, vectors=None):
+    """
+    Vectorizes a batch of chunks in one encode call, adds the whole matrix to FAISS
+    and stores the rows in SQLite with a single executemany
 
-  print("Loading and chunking documents...")
-  all_chunks = load_chunks('chunks.pkl')
+    Args:
+        chunk_dicts: List of dictionaries with 'text', 'document', and 'section' keys
+        embedding_model: SentenceTransformer model
+        faiss_index: FAISS index
+        cursor: SQLite cursor
+        batch_size: Batch size passed to SentenceTransformer.encode
+        vectors: Optional precomputed embeddings for the batch (skips encoding)
+
+    Returns:
+        list: The chunk ids assigned to the batch, in order
+    """
+    if not chunk_dicts:
+        return []
+
+    # 1. Vectorize the whole batch at once
+    texts = [chunk['text'] for chunk in chunk_dicts]
+    if vectors is None:
+        vectors = embedding_model.encode(texts, batch_size=batch_size)
+    vectors = np.asarray(vectors, dtype='float32').reshape(len(texts), -1)
 
-  print(f"\nAdding {len(all_chunks)} chunks to database...")
-  for chunk in all_chunks:
-      rag.add_chunk(chunk)
+    # 2. Add to SQLite with explicit ids and the original vectors, which re-rank compressed indexes
+    #    (on failure the caller rolls back its transaction and removes these ids from FAISS)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM chunks")
+    first_id = cursor.fetchone()[0] + 1
+    ids = list(range(first_id, first_id + len(chunk_dicts)))
+    cursor.executemany(
+        "INSERT INTO chunks (id, text, document, section, content_hash, category, source_url, scraped_date, "
+        "embedding) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(chunk_id, chunk['text'], chunk['document'], chunk['section'], content_hash(chunk['text']),
+          *(chunk.get(column) for column in METADATA_COLUMNS), vector.tobytes())
+         for chunk_id, chunk, vector in zip(ids, chunk_dicts, vectors)]
+    )
 
-  rag.commit()
-  rag.save_databases()
+    # 3. Add the matrix to FAISS keyed by the same ids
+    faiss_index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    return ids
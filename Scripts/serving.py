@@ -0,0 +1,204 @@
+"""
+asyncio serving front-end for the RAG system.
+
+Concurrent requests are queued, coalesced into micro-batches (one embedder call,
+one FAISS search and one LLM generate per batch) and run in worker threads, with
+a bounded queue for backpressure and de-duplication of identical in-flight queries.
+
+    rag = RAG.load_from_saved(...)
+    async with RAGService(rag, max_batch_size=8, max_wait_ms=20) as service:
+        result = await service.generate("What causes diabetes?")
+"""
+
+import asyncio
+import time
+
+from caching import normalize_query
+
+
+class ServiceOverloaded(Exception):
+    """Raised when the request queue is full and the service is set to reject instead of wait"""
+
+
+class MicroBatcher:
+    """
+    Collects submitted items into batches of up to max_batch_size, waiting at most
+    max_wait_ms after the first item, and runs process_batch(items) in a worker thread.
+    Identical keys submitted while a request is still in flight share one result.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=20, max_queue_size=256,
+                 max_concurrency=1, reject_when_full=False):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.max_concurrency = max_concurrency
+        self.reject_when_full = reject_when_full
+        self.stats = {'requests': 0, 'deduplicated': 0, 'rejected': 0, 'batches': 0, 'batched_items': 0}
+        self._queue = None
+        self._semaphore = None
+        self._in_flight = {}
+        self._running = set()
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def submit(self, key, item):
+        """Queue one item and wait for its result (shared with identical in-flight keys)"""
+        self.stats['requests'] += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats['deduplicated'] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.reject_when_full:
+                self._queue.put_nowait((key, item, future))
+            else:
+                await self._queue.put((key, item, future))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            del self._in_flight[key]
+            raise ServiceOverloaded(f"Request queue is full ({self.max_queue_size} pending)")
+        except BaseException:
+            del self._in_flight[key]
+            raise
+
+        # Shield so one cancelled caller does not cancel the result shared with others
+        return await asyncio.shield(future)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Concurrency limit: wait for a free slot, then keep collecting while this batch runs
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch):
+        keys = [key for key, _, _ in batch]
+        items = [item for _, item, _ in batch]
+        futures = [future for _, _, future in batch]
+        self.stats['batches'] += 1
+        self.stats['batched_items'] += len(batch)
+        try:
+            results = await asyncio.to_thread(self.process_batch, items)
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for key in keys:
+                self._in_flight.pop(key, None)
+            self._semaphore.release()
+
+
+class RAGService:
+    """
+    asyncio service around a RAG instance with separate micro-batchers for full
+    generation and retrieval-only requests.
+
+    Args:
+        rag: RAG instance (mode='retrieval' only supports retrieve())
+        max_batch_size: Maximum requests coalesced into one batch
+        max_wait_ms: How long the first request of a batch waits for company
+        max_concurrency: Batches allowed to run at the same time. RAG keeps per-call state
+            (context, stats), so keep this at 1 unless each batch uses its own instance.
+        max_queue_size: Pending requests before backpressure kicks in
+        reject_when_full: Raise ServiceOverloaded instead of waiting when the queue is full
+        k: Chunks retrieved per query for retrieve()
+    """
+
+    def __init__(self, rag, max_batch_size=8, max_wait_ms=20, max_concurrency=1,
+                 max_queue_size=256, reject_when_full=False, k=3):
+        self.rag = rag
+        self.k = k
+        batcher_args = dict(max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_queue_size=max_queue_size,
+                            max_concurrency=max_concurrency, reject_when_full=reject_when_full)
+        self._generate = MicroBatcher(self._generate_batch, **batcher_args)
+        self._retrieve = MicroBatcher(self._retrieve_batch, **batcher_args)
+
+    async def start(self):
+        self._generate.start()
+        self._retrieve.start()
+
+    async def stop(self):
+        await self._generate.stop()
+        await self._retrieve.stop()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def _generate_batch(self, items):
+        """Runs in a worker thread: one llm_generate_batch call per source language in the batch"""
+        results = [None] * len(items)
+        for language in dict.fromkeys(language for _, language in items):
+            indices = [i for i, (_, lang) in enumerate(items) if lang == language]
+            answers = self.rag.llm_generate_batch([items[i][0] for i in indices], source_language=language,
+                                                  batch_size=len(indices))
+            for i, answer, contexts in zip(indices, answers, self.rag.contexts):
+                results[i] = {'answer': answer, 'contexts': contexts}
+        return results
+
+    def _retrieve_batch(self, queries):
+        return self.rag.query_chunks_batch(queries, k=self.k)
+
+    async def generate(self, query, source_language='en'):
+        """
+        Answer one question; concurrent calls are generated together
+
+        Returns:
+            dict: {'answer', 'contexts', 'latency_s'}
+        """
+        start = time.perf_counter()
+        result = await self._generate.submit((normalize_query(query), source_language), (query, source_language))
+        return {**result, 'latency_s': time.perf_counter() - start}
+
+    async def retrieve(self, query):
+        """Retrieve the top-k chunks for one (corpus-language) query; concurrent calls share one search"""
+        return await self._retrieve.submit(normalize_query(query), query)
+
+    def stats(self):
+        """Request, de-duplication, rejection and batch-size counters per endpoint"""
+        report = {}
+        for name, batcher in (('generate', self._generate), ('retrieve', self._retrieve)):
+            stats = dict(batcher.stats)
+            stats['mean_batch_size'] = stats['batched_items'] / stats['batches'] if stats['batches'] else 0.0
+            report[name] = stats
+        return report
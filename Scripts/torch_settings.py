@@ -0,0 +1,64 @@
+"""
+Device-aware dtype selection and CPU int8 quantization for the Hugging Face models.
+
+fp16 is only fast on GPUs; on CPU PyTorch runs most fp16 kernels through slow
+fallbacks. On CPU-only hosts models are therefore loaded in bf16 when the CPU has
+native bf16 instructions (AVX512-BF16 / AMX) and in fp32 otherwise. 'int8' keeps fp32
+weights for everything but the nn.Linear layers, which are dynamically quantized.
+"""
+
+import torch
+
+
+# dtype names accepted by resolve_dtype ('auto' picks per device)
+DTYPES = ('auto', 'float16', 'bfloat16', 'float32')
+
+QUANTIZATIONS = (None, 'int8')
+
+
+def cpu_supports_bf16():
+    """True if the CPU has native bf16 matmul instructions"""
+    for check in ('_is_avx512_bf16_supported', '_is_amx_tile_supported'):
+        supported = getattr(torch.cpu, check, None)
+        if supported is not None and supported():
+            return True
+    return False
+
+
+def resolve_dtype(dtype='auto', quantization=None):
+    """
+    Picks the torch dtype and device_map a model is loaded with
+
+    Args:
+        dtype: One of DTYPES; 'auto' is float16 on GPU, bfloat16 or float32 on CPU
+        quantization: None or 'int8' (dynamic quantization, CPU only, loads fp32 weights)
+
+    Returns:
+        tuple: (torch dtype, device_map for from_pretrained)
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}, got {dtype!r}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}, got {quantization!r}")
+
+    if quantization == 'int8':
+        return torch.float32, 'cpu'
+    if torch.cuda.is_available():
+        return (torch.float16 if dtype == 'auto' else getattr(torch, dtype)), 'auto'
+    if dtype == 'auto':
+        return (torch.bfloat16 if cpu_supports_bf16() else torch.float32), 'cpu'
+    if dtype == 'float16':
+        print("⚠ WARNING: float16 on CPU is emulated and slow, consider dtype='auto'")
+    return getattr(torch, dtype), 'cpu'
+
+
+def quantize_int8(model):
+    """Dynamically quantizes every nn.Linear layer of a CPU model to int8 weights"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def set_threads(num_threads):
+    """Sets the intra-op thread count used by PyTorch CPU kernels (None leaves the default)"""
+    if num_threads is not None:
+        torch.set_num_threads(int(num_threads))
+    return torch.get_num_threads()
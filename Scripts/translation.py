@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+
+import torch
+
+from rag_functions import split_sentences, SQLITE_MAX_PARAMS
+
+
+# Direction -> (source language, target language)
+DIRECTIONS = {
+    'en-zh': ('en', 'zh'),
+    'zh-en': ('zh', 'en'),
+}
+
+# Output cap per generate call: length_ratio * longest source sentence (in tokens) + this margin.
+# Marian otherwise decodes up to its configured max_length (512) when a beam fails to stop.
+OUTPUT_LENGTH_MARGIN = 10
+
+
+class TranslationCache:
+    """
+    Persistent translation cache keyed by (direction, source text), stored in its own SQLite file.
+    The direction may carry a suffix naming the decoding settings (see translate_batch's cache_key).
+    """
+
+    def __init__(self, path='translation_cache.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS translations (
+                    direction TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    PRIMARY KEY (direction, source))
+                ''')
+            self.conn.commit()
+
+    def get_many(self, direction, texts):
+        """
+        Looks up many source strings at once
+
+        Returns:
+            dict: source -> cached translation, for the strings that were cached
+        """
+        texts = list(dict.fromkeys(texts))
+        found = {}
+        with self._lock:
+            for start in range(0, len(texts), SQLITE_MAX_PARAMS):
+                part = texts[start:start + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(part))
+                rows = self.conn.execute(
+                    f"SELECT source, target FROM translations WHERE direction = ? AND source IN ({placeholders})",
+                    [direction, *part]).fetchall()
+                found.update(rows)
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, direction, pairs):
+        """Stores (source, target) pairs for a direction"""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO translations (direction, source, target) VALUES (?, ?, ?)",
+                [(direction, source, target) for source, target in pairs])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def close(self):
+        self.conn.close()
+
+
+def translate_texts(texts, model, tokenizer, batch_size=16, max_length=512, length_ratio=2.0, **generate_kwargs):
+    """
+    Translates a list of strings with a Marian model in padded batches. Inputs are
+    sorted by length first so each batch pads to a similar length.
+
+    Args:
+        texts: List of strings
+        model: MarianMTModel
+        tokenizer: MarianTokenizer
+        batch_size: Number of strings per generate call
+        max_length: Input truncation length in tokens
+        length_ratio: Caps max_new_tokens at length_ratio * the batch's longest input + OUTPUT_LENGTH_MARGIN
+            (None keeps the model's max_length); ignored if max_new_tokens is passed
+        **generate_kwargs: Passed through to model.generate (e.g. num_beams=1 for greedy decoding)
+
+    Returns:
+        list: Translations in the same order as texts
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    results = [None] * len(texts)
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        inputs = tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True,
+                           truncation=True, max_length=max_length).to(model.device)
+        kwargs = dict(generate_kwargs)
+        if length_ratio is not None and 'max_new_tokens' not in kwargs:
+            source_tokens = int(inputs['attention_mask'].sum(1).max())
+            kwargs['max_new_tokens'] = int(source_tokens * length_ratio) + OUTPUT_LENGTH_MARGIN
+        with torch.no_grad():
+            translated = model.generate(**inputs, **kwargs)
+        for i, result in zip(batch, tokenizer.batch_decode(translated, skip_special_tokens=True)):
+            results[i] = result
+
+    return results
+
+
+def _segment(text, sentence_split):
+    """Splits text into lines, and each line into sentences"""
+    lines = text.split('\n')
+    if not sentence_split:
+        return [[line] if line.strip() else [] for line in lines]
+    return [split_sentences(line) for line in lines]
+
+
+def translate_batch(texts, direction, model, tokenizer, cache=None, batch_size=16,
+                    sentence_split=True, cache_key=None, **generate_kwargs):
+    """
+    Translates many texts at once. Each text is split into sentences, so long responses
+    become a padded batch of short sequences instead of one sequence that Marian would
+    truncate at 512 tokens. Sentences are de-duplicated, served from the cache where
+    possible, and reassembled per text with line breaks preserved.
+
+    Args:
+        texts: List of strings
+        direction: 'en-zh' or 'zh-en'
+        model: MarianMTModel for the direction
+        tokenizer: MarianTokenizer for the direction
+        cache: Optional TranslationCache
+        batch_size: Number of sentences per generate call
+        sentence_split: Translate sentence by sentence (True) or line by line (False)
+        cache_key: Name of the decoding settings, so translations made with different beams,
+            length caps or quantization are cached separately
+        **generate_kwargs: Passed through to translate_texts (length_ratio, num_beams, ...)
+
+    Returns:
+        list: Translations in the same order as texts
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown translation direction: {direction}")
+    joiner = '' if DIRECTIONS[direction][1] == 'zh' else ' '
+
+    segmented = [_segment(text, sentence_split) for text in texts]
+    sentences = list(dict.fromkeys(s for lines in segmented for line in lines for s in line))
+
+    cache_direction = f"{direction}|{cache_key}" if cache_key else direction
+    translations = cache.get_many(cache_direction, sentences) if cache is not None else {}
+    missing = [s for s in sentences if s not in translations]
+    if missing:
+        translated = translate_texts(missing, model, tokenizer, batch_size=batch_size, **generate_kwargs)
+        translations.update(zip(missing, translated))
+        if cache is not None:
+            cache.put_many(cache_direction, zip(missing, translated))
+
+    return [
+        '\n'.join(joiner.join(translations[s] for s in line) for line in lines)
+        for lines in segmented
+    ]